@@ -41,3 +41,65 @@ CREATE INDEX IF NOT EXISTS idx_edges_target ON document_edges(target_node_id);
 CREATE INDEX IF NOT EXISTS idx_nodes_name ON document_nodes(entity_name);
 CREATE INDEX IF NOT EXISTS idx_edges_confidence ON document_edges(confidence); -- NEU: Index für schnelles Filtern nach Qualität
 
+-- 5. Volltextsuche (deutsch) für die Keyword-Suche
+-- Ersetzt das nicht indizierbare ILIKE '%...%' durch einen GIN-Index mit echtem Ranking.
+-- Idempotent: kann auf bestehenden Datenbanken erneut ausgeführt werden.
+ALTER TABLE document_chunks
+    ADD COLUMN IF NOT EXISTS content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('german', coalesce(content, ''))) STORED;
+CREATE INDEX IF NOT EXISTS idx_chunks_tsv ON document_chunks USING gin (content_tsv);
+
+-- 6. Inkrementelles Re-Indexing
+-- parent_documents.metadata enthält file_hash, file_size, file_mtime, chunk_hash und chunk_index;
+-- die Ingestion vergleicht pro Titel, daher ein Index auf title.
+CREATE INDEX IF NOT EXISTS idx_parents_title ON parent_documents(title);
+-- Ersetzte bzw. gelöschte Parents entfernen ihre Chunks und Kanten per ON DELETE CASCADE;
+-- ohne diese Indizes würde jedes DELETE beide Tabellen komplett durchsuchen.
+-- idx_edges_source_doc dient außerdem dem Nachladen der Knoten eines Dokuments (entities.py).
+CREATE INDEX IF NOT EXISTS idx_chunks_parent ON document_chunks(parent_id);
+CREATE INDEX IF NOT EXISTS idx_edges_source_doc ON document_edges(source_doc_id);
+
+-- 7. Ingestion-Jobs (Checkpoints für abgebrochene Läufe)
+-- Ein Job pro Datei; markdown hält das Docling-Ergebnis, bis das Dokument abgeschlossen ist.
+CREATE TABLE IF NOT EXISTS ingestion_jobs (
+    file_path TEXT PRIMARY KEY,
+    file_hash TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending | running | failed | done
+    stage TEXT,                              -- convert | extract | embed | write | finalize
+    attempts INT NOT NULL DEFAULT 0,
+    last_error TEXT,
+    markdown TEXT,
+    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs(status) WHERE status <> 'done';
+
+-- 8. Aliase für die Entitätserkennung im Backend (optional, manuell gepflegt)
+-- z.B. INSERT INTO entity_aliases VALUES ('DRK', (SELECT id FROM document_nodes WHERE entity_name = 'Deutsches Rotes Kreuz'));
+CREATE TABLE IF NOT EXISTS entity_aliases (
+    alias TEXT NOT NULL,
+    node_id UUID NOT NULL REFERENCES document_nodes(id) ON DELETE CASCADE,
+    PRIMARY KEY (alias, node_id)
+);
+CREATE INDEX IF NOT EXISTS idx_entity_aliases_node ON entity_aliases(node_id);
+
+-- 9. Kompakte Vektorindizes für VECTOR_MODE=halfvec bzw. VECTOR_MODE=binary (engine.py)
+-- Die Spalte embedding bleibt vector(1024) und dient dem exakten Re-Scoring der Shortlist;
+-- nur der HNSW-Index liegt quantisiert vor (halfvec: halber, binary: 1/32 des Speichers).
+-- Benötigt pgvector >= 0.7 (Image pgvector/pgvector, siehe docker-compose.yaml).
+-- Standard ist VECTOR_MODE=full mit idx_chunks_hnsw (Abschnitt 4). Jeder weitere HNSW-Index
+-- wird bei jedem Insert mitgepflegt, daher nur den Index des gewählten Modus anlegen:
+-- die passenden Zeilen einkommentieren und den vollen Index entfernen. Achtung: ein erneuter
+-- Lauf dieses Skripts legt idx_chunks_hnsw (Abschnitt 4) wieder an und muss den DROP wiederholen.
+ALTER EXTENSION vector UPDATE;
+
+-- VECTOR_MODE=halfvec:
+-- CREATE INDEX IF NOT EXISTS idx_chunks_hnsw_halfvec
+--     ON document_chunks USING hnsw ((embedding::halfvec(1024)) halfvec_cosine_ops);
+-- DROP INDEX IF EXISTS idx_chunks_hnsw_binary;
+-- DROP INDEX IF EXISTS idx_chunks_hnsw;
+
+-- VECTOR_MODE=binary:
+-- CREATE INDEX IF NOT EXISTS idx_chunks_hnsw_binary
+--     ON document_chunks USING hnsw ((binary_quantize(embedding)::bit(1024)) bit_hamming_ops);
+-- DROP INDEX IF EXISTS idx_chunks_hnsw_halfvec;
+-- DROP INDEX IF EXISTS idx_chunks_hnsw;
@@ -1,16 +1,99 @@
-from fastapi import FastAPI
+import os
+import sys
+import json
+import time
+import asyncio
+import random
+import logging
+import subprocess
+import threading
+from fastapi import FastAPI, Response, HTTPException
+from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel
 from typing import Optional, List, Any
+from contextlib import asynccontextmanager
 import uvicorn
-from engine import search_hybrid_graph, llm 
+import engine
+from engine import search_hybrid_graph, search_hybrid_graph_batch, llm, estimate_tokens
+from cache import normalize_key
+from router import route_message, needs_rewrite
+from metrics import span, observe, start_timings, record_llm_usage, record_context_tokens, render_metrics
 
-app = FastAPI(title="SCHNOOR Hybrid RAG API")
+# LOGGING
+# LOG_LEVEL=DEBUG aktiviert das Prompt-Logging, PROMPT_LOG_SAMPLE_RATE begrenzt es
+# auf einen Anteil der Anfragen (Prompts sind groß, Logging kostet unter Last)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+PROMPT_LOG_SAMPLE_RATE = float(os.getenv("PROMPT_LOG_SAMPLE_RATE", "0.1"))
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("rag.api")
+
+# WORKER: Anzahl uvicorn-Prozesse und maximale gleichzeitige Verbindungen pro Worker
+# (0 = unbegrenzt, darüber antwortet uvicorn mit 503). DB_POOL_MAX_SIZE gilt pro Worker
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+API_WORKER_CONCURRENCY = int(os.getenv("API_WORKER_CONCURRENCY", "0"))
+# Socket des gemeinsamen Reranker-Prozesses, den api.py bei API_WORKERS > 1 startet
+RERANK_SOCKET_DEFAULT = "/tmp/rag-rerank.sock"
+
+# BATCH-ABFRAGEN: maximale Anzahl Fragen pro Aufruf und parallele Antwort-Generierungen
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "1000"))
+QUERY_BATCH_LLM_CONCURRENCY = int(os.getenv("QUERY_BATCH_LLM_CONCURRENCY", "4"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # DB-Pool beim Start öffnen und beim Beenden sauber schließen
+    await engine.startup()
+    yield
+    await engine.shutdown()
+
+app = FastAPI(title="SCHNOOR Hybrid RAG API", lifespan=lifespan)
 
 class ChatQuery(BaseModel):
     question: Any # Erlaubt Text oder die Liste aus der Open WebUI Pipe
+    timings: bool = False # Stufen-Zeiten und Token-Zahlen in der Antwort mitliefern
 
-@app.post("/query")
-async def handle_query(query: ChatQuery):
+class BatchQuery(BaseModel):
+    questions: List[str]
+    answer: bool = True # False = nur Retrieval (Quellen & Graph), ohne LLM-Antwort
+    timings: bool = False # Summierte Stufen-Zeiten im abschließenden "done"-Event
+
+async def rewrite_query(messages, last_user_message):
+    history_context = ""
+    for msg in messages[-3:-1]:
+        history_context += f"{msg['role']}: {msg['content']}\n"
+
+    # Gleicher Verlauf + gleiche Frage (z.B. erneut gesendet oder von mehreren Clients) -> gecachtes Rewriting
+    key = normalize_key(f"{history_context}\n{last_user_message}")
+    cached = engine.rewrite_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    rewrite_prompt = f"""
+    Erstelle basierend auf dem Chat-Verlauf eine präzise, eigenständige Suchanfrage.
+    Ersetze Pronomen (er, sie, es, dort) durch die tatsächlichen Subjekte aus dem Verlauf.
+    
+    VERLAUF:
+    {history_context}
+    
+    AKTUELLE FRAGE:
+    {last_user_message}
+    
+    Antworte NUR mit der umformulierten Suchanfrage (keine Einleitung).
+    """
+    try:
+        with span("api", "rewrite"):
+            rewrite_res = await engine.fast_llm.ainvoke([("user", rewrite_prompt)])
+        record_llm_usage("rewrite", rewrite_res)
+        rewritten = rewrite_res.content.strip()
+    except Exception as e:
+        logger.warning("Fehler beim Query Rewriting: %s", e)
+        return last_user_message
+    engine.rewrite_cache.set(key, rewritten)
+    return rewritten
+
+SMALLTALK_CONTEXT = ("Kein Kontext (Smalltalk)", "Keine Tripel (Smalltalk)")
+
+async def build_llm_messages(query: ChatQuery):
+    """Gemeinsame Vorbereitung für /query und /query/stream: Routing, Rewriting, Suche und Prompt."""
     # 1. DATEN SORTIEREN
     if isinstance(query.question, list):
         messages = query.question
@@ -19,42 +102,30 @@ async def handle_query(query: ChatQuery):
         messages = []
         last_user_message = query.question
 
-    # 2. QUERY REWRITING
-    search_query = last_user_message
-    if len(messages) > 1:
-        history_context = ""
-        for msg in messages[-3:-1]:
-            history_context += f"{msg['role']}: {msg['content']}\n"
-        
-        rewrite_prompt = f"""
-        Erstelle basierend auf dem Chat-Verlauf eine präzise, eigenständige Suchanfrage.
-        Ersetze Pronomen (er, sie, es, dort) durch die tatsächlichen Subjekte aus dem Verlauf.
-        
-        VERLAUF:
-        {history_context}
-        
-        AKTUELLE FRAGE:
-        {last_user_message}
-        
-        Antworte NUR mit der umformulierten Suchanfrage (keine Einleitung).
-        """
-        try:
-            rewrite_res = llm.invoke([("user", rewrite_prompt)])
-            search_query = rewrite_res.content.strip()
-        except Exception as e:
-            print(f"Fehler beim Query Rewriting: {e}")
-            search_query = last_user_message
+    # 2. ROUTING: Smalltalk ohne Suche und ohne Rewriting beantworten
+    with span("api", "route"):
+        route = await route_message(last_user_message, engine.entity_matcher, engine.fast_llm, engine.route_cache)
 
-    # 3. HYBRID SUCHE (Mit Begrüßungs-Check)
-    common_greetings = ["hi", "hallo", "hey", "moin", "servus", "guten tag"]
-    if last_user_message.lower().strip() in common_greetings:
-       context, graph = "Kein Kontext (Begrüßung)", "Keine Tripel (Begrüßung)"
+    # 3. QUERY REWRITING & HYBRID SUCHE
+    if route == "smalltalk":
+       context, graph = SMALLTALK_CONTEXT
     else:
-       # Nur wenn es keine einfache Begrüßung ist, suchen wir in den Dokumenten
-       context, graph = search_hybrid_graph(search_query)
+       # Rewriting nur bei Folgefragen, die sich auf den Verlauf beziehen.
+       # Es läuft innerhalb der Suche parallel zur Entitäts-Extraktion.
+       has_entities = bool(engine.entity_matcher.match(last_user_message))
+       rewrite = None
+       if len(messages) > 1 and needs_rewrite(last_user_message, has_entities):
+           rewrite = rewrite_query(messages, last_user_message)
+       with span("api", "search"):
+           context, graph = await search_hybrid_graph(last_user_message, rewrite=rewrite)
+    record_context_tokens(estimate_tokens(context) + estimate_tokens(graph))
+    return build_prompt(messages, last_user_message, context, graph), context, graph
 
-    # 4. SYSTEM PROMPT
-    system_prompt = f"""
+# 4. SYSTEM PROMPT
+# Für alle Anfragen identisch, damit Ollama den KV-Cache dieses Präfixes (und des
+# bisherigen Verlaufs) wiederverwenden kann. Graph und Kontext ändern sich pro Anfrage
+# und stehen deshalb erst in der letzten Nutzer-Nachricht.
+SYSTEM_PROMPT = """
     ### DEINE ROLLE ###
     Du bist der offizielle SCHNOOR Wissensexperte. Antworte basierend auf den bereitgestellten Daten.
     Dein Ziel: Maximale Vollständigkeit und Korrektheit.
@@ -65,11 +136,7 @@ async def handle_query(query: ChatQuery):
     3. DATENTREUE: Fakten aus dem WISSENSGRAPH und TEXT-KONTEXT haben bei Fachfragen absolute Priorität.
 
     ### DATENGRUNDLAGE (Nur für Fachfragen) ###
-    1. WISSENSGRAPH (Strukturierte Fakten):
-    {graph}
-
-    2. TEXT-KONTEXT (Detaillierte Belege):
-    {context}
+    Die DATENGRUNDLAGE (1. WISSENSGRAPH, 2. TEXT-KONTEXT) steht jeweils in der letzten Nachricht vor der FRAGE.
 
     ### ARBEITSANWEISUNG ###
     - Schritt 1: Entscheide, ob die Frage eine Begrüßung oder allgemeine Frage ist. Wenn ja, antworte direkt. Wenn Nein, nutze die Datengrundlage! 
@@ -84,38 +151,208 @@ async def handle_query(query: ChatQuery):
     - Keine Sätze wie "Laut Dokument...". Antworte direkt.
     - ABSCHNITT QUELLEN: Liste alle verwendeten Quellen am Ende exakt so auf: [Titel](URL)
     """
-    
+
+def build_prompt(messages, last_user_message, context, graph):
     # 5. CHAT-HISTORIE FÜR DAS LLM AUFBEREITEN
-    llm_messages = [("system", system_prompt)]
+    # Reihenfolge: festes System-Prompt -> Verlauf -> Datengrundlage + aktuelle Frage
+    llm_messages = [("system", SYSTEM_PROMPT)]
     
     if isinstance(messages, list):
         for msg in messages[:-1]:
             role = "user" if msg.get("role") == "user" else "assistant"
             llm_messages.append((role, msg.get("content", "")))
 
-    llm_messages.append(("user", last_user_message))
+    llm_messages.append(("user", f"""### DATENGRUNDLAGE (Nur für Fachfragen) ###
+1. WISSENSGRAPH (Strukturierte Fakten):
+{graph}
 
-    # --- DEBUG LOGGING ---
-    print("\n" + "!"*60)
-    print("🚀 FINALER PROMPT AN OLLAMA (QWEN-32B)")
-    print("!"*60)
-    
-    for msg_type, content in llm_messages:
-        print(f"\n--- ROLE: {msg_type.upper()} ---")
-        print(content)
-    
-    print("\n" + "!"*60)
-    print("ENDE DES PROMPTS - WARTE AUF GENERIERUNG...")
-    print("!"*60 + "\n")
+2. TEXT-KONTEXT (Detaillierte Belege):
+{context}
+
+### FRAGE ###
+{last_user_message}"""))
+
+    # --- DEBUG LOGGING (nur bei LOG_LEVEL=DEBUG und nur für eine Stichprobe) ---
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < PROMPT_LOG_SAMPLE_RATE:
+        logger.debug(
+            "🚀 FINALER PROMPT AN OLLAMA:\n%s",
+            "\n".join(f"--- ROLE: {msg_type.upper()} ---\n{content}" for msg_type, content in llm_messages),
+        )
 
-    # 6. ANTWORT GENERIEREN
-    response = llm.invoke(llm_messages)
+    return llm_messages
+
+@app.post("/query")
+async def handle_query(query: ChatQuery):
+    timings = start_timings()
+    with span("api", "request"):
+        llm_messages, context, graph = await build_llm_messages(query)
+
+        # 6. ANTWORT GENERIEREN
+        with span("api", "generate"):
+            response = await llm.ainvoke(llm_messages)
+        record_llm_usage("answer", response)
+    logger.info("⏱️ /query %s", timings.summary())
     
-    return {
+    result = {
         "answer": response.content,
         "sources": str(context),
         "graph": str(graph)
     }
+    if query.timings:
+        result["timings"] = timings.as_dict()
+    return result
+
+@app.post("/query/stream")
+async def handle_query_stream(query: ChatQuery):
+    # Streaming-Variante: Tokens als NDJSON-Zeilen, Quellen & Graph als letztes Event
+    timings = start_timings()
+    with span("api", "prepare"):
+        llm_messages, context, graph = await build_llm_messages(query)
+
+    async def event_stream():
+        last_chunk = None
+        try:
+            with span("api", "generate", timings):
+                started = time.perf_counter()
+                async for chunk in llm.astream(llm_messages):
+                    if started is not None:
+                        observe("api", "first_token", time.perf_counter() - started, timings)
+                        started = None
+                    # Ollama liefert die Token-Zahlen im letzten Chunk
+                    if chunk.response_metadata or getattr(chunk, "usage_metadata", None):
+                        last_chunk = chunk
+                    if chunk.content:
+                        yield json.dumps({"type": "token", "content": chunk.content}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.warning("Fehler beim Streaming: %s", e)
+            yield json.dumps({"type": "error", "content": str(e)}, ensure_ascii=False) + "\n"
+            return
+        if last_chunk is not None:
+            record_llm_usage("answer", last_chunk, timings)
+        logger.info("⏱️ /query/stream %s", timings.summary())
+        event = {"type": "sources", "sources": str(context), "graph": str(graph)}
+        if query.timings:
+            event["timings"] = timings.as_dict()
+        yield json.dumps(event, ensure_ascii=False) + "\n"
+        yield json.dumps({"type": "done"}) + "\n"
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+@app.post("/query/batch")
+async def handle_query_batch(batch: BatchQuery):
+    # Viele Fragen auf einmal (z.B. Evaluation): eine NDJSON-Zeile pro Frage, sobald sie fertig ist.
+    # Embeddings, SQL, Re-Ranking und Parents werden über die Fragen hinweg gebündelt
+    if len(batch.questions) > QUERY_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Maximal {QUERY_BATCH_MAX} Fragen pro Aufruf")
+    questions = batch.questions
+
+    async def event_stream():
+        timings = start_timings()
+        started = time.perf_counter()
+        events = asyncio.Queue()
+        slots = asyncio.Semaphore(QUERY_BATCH_LLM_CONCURRENCY)
+        # Laufende Antwort-Generierungen; werden beim Abbruch des Streams mit abgebrochen
+        finishers = set()
+
+        async def finish(index, context, graph):
+            question = questions[index]
+            event = {"type": "result", "index": index, "question": question, "sources": str(context), "graph": str(graph)}
+            if batch.answer:
+                async with slots:
+                    try:
+                        with span("api", "generate"):
+                            response = await llm.ainvoke(build_prompt([], question, context, graph))
+                        record_llm_usage("answer", response)
+                        event["answer"] = response.content
+                    except Exception as e:
+                        logger.warning("Fehler bei der Batch-Antwort %d: %s", index, e)
+                        event = {"type": "error", "index": index, "question": question, "content": str(e)}
+            events.put_nowait(event)
+
+        async def produce():
+            # Kein Smalltalk-Routing: Für Evaluationen muss jede gelabelte Frage durch die Suche,
+            # auch kurze wie "Gut?" oder "Top"
+            with span("api", "search"):
+                async for i, result in search_hybrid_graph_batch(questions):
+                    if isinstance(result, Exception):
+                        events.put_nowait({"type": "error", "index": i, "question": questions[i], "content": str(result)})
+                    else:
+                        record_context_tokens(estimate_tokens(result[0]) + estimate_tokens(result[1]))
+                        finishers.add(asyncio.create_task(finish(i, *result)))
+            await asyncio.gather(*finishers)
+
+        producer = asyncio.create_task(produce())
+        try:
+            for _ in range(len(questions)):
+                getter = asyncio.create_task(events.get())
+                await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done() and producer.exception() is not None:
+                    # Unerwarteter Fehler im Produzenten: abbrechen statt ewig zu warten
+                    getter.cancel()
+                    logger.warning("Fehler in /query/batch: %s", producer.exception())
+                    yield json.dumps({"type": "error", "content": str(producer.exception())}, ensure_ascii=False) + "\n"
+                    return
+                yield json.dumps(await getter, ensure_ascii=False) + "\n"
+        finally:
+            # Client getrennt oder Fehler: keine Generierungen für Antworten weiterlaufen lassen, die niemand liest
+            producer.cancel()
+            for task in finishers:
+                task.cancel()
+
+        logger.info("⏱️ /query/batch %d Fragen in %.2fs", len(questions), time.perf_counter() - started)
+        done = {"type": "done", "count": len(questions), "seconds": round(time.perf_counter() - started, 3)}
+        if batch.timings:
+            done["timings"] = timings.as_dict()
+        yield json.dumps(done) + "\n"
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+@app.get("/health")
+async def health():
+    # Liveness: Prozess läuft und beantwortet Anfragen (auch während des Warm-ups)
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    # Readiness: erst nach dem Warm-up und mit erreichbarer Datenbank 200, sonst 503
+    is_ready, components = await engine.check_ready()
+    return JSONResponse({"ready": is_ready, "components": components}, status_code=200 if is_ready else 503)
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus-Scrape: Stufen-Histogramme, Token-Zähler und Cache-Statistiken
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+def supervise_rerank_server(stop, restart_delay=2.0):
+    """Startet den gemeinsamen Reranker-Prozess und startet ihn neu, falls er abstürzt."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reranker.py")
+    while not stop.is_set():
+        process = subprocess.Popen([sys.executable, script])
+        while process.poll() is None and not stop.wait(1.0):
+            pass
+        if stop.is_set():
+            process.terminate()
+            process.wait()
+            return
+        logger.warning("⚠️ Reranker-Prozess beendet (Exit-Code %s), Neustart in %ss", process.returncode, restart_delay)
+        stop.wait(restart_delay)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8050)
+    limit_concurrency = API_WORKER_CONCURRENCY or None
+    if API_WORKERS <= 1:
+        uvicorn.run(app, host="0.0.0.0", port=8050, limit_concurrency=limit_concurrency)
+    else:
+        # Mehrere Worker: Der Cross-Encoder läuft nur einmal in einem eigenen Prozess,
+        # die Worker erben RERANK_SOCKET und schicken ihre Paare dorthin
+        supervisor, stop = None, threading.Event()
+        if engine.reranker.enabled and not os.getenv("RERANK_SOCKET"):
+            os.environ["RERANK_SOCKET"] = RERANK_SOCKET_DEFAULT
+            supervisor = threading.Thread(target=supervise_rerank_server, args=(stop,), daemon=True)
+            supervisor.start()
+        try:
+            uvicorn.run("api:app", host="0.0.0.0", port=8050, workers=API_WORKERS, limit_concurrency=limit_concurrency)
+        finally:
+            stop.set()
+            if supervisor is not None:
+                supervisor.join()
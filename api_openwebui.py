@@ -1,3 +1,4 @@
+import json
 import requests
 from pydantic import BaseModel
 from typing import Union, Generator
@@ -12,6 +13,10 @@ class Pipe:
     def pipe(self, body: dict, __user__: dict = None) -> Union[str, Generator]:
         user_message = body["messages"]
 
+        # Open WebUI fragt standardmäßig gestreamt an
+        if body.get("stream", True):
+            return self.stream_answer(user_message)
+
         try:
             # Verbindung zum Docker-Backend
             response = requests.post(
@@ -22,3 +27,25 @@ class Pipe:
             return response.json()["answer"]
         except Exception as e:
             return f"Fehler: {str(e)}"
+
+    def stream_answer(self, user_message) -> Generator:
+        try:
+            # Timeout gilt pro gelesenem Chunk, nicht für die gesamte Antwort
+            with requests.post(
+                "http://rag_backend:8050/query/stream",
+                json={"question": user_message},
+                stream=True,
+                timeout=(10, 120),
+            ) as response:
+                response.raise_for_status()
+                response.encoding = "utf-8"
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event["type"] == "token":
+                        yield event["content"]
+                    elif event["type"] == "error":
+                        yield f"\n\nFehler: {event['content']}"
+        except Exception as e:
+            yield f"Fehler: {str(e)}"
@@ -0,0 +1,109 @@
+import os
+import json
+import random
+import argparse
+
+# Synthetischer, reproduzierbarer Korpus für den Benchmark: ein Markdown-Dokument
+# pro Projekt mit eindeutigen Fakten (Leitung, Ort, Auftraggeber, Technik, Budget)
+# plus gemeinsamem Fülltext als Störmaterial. Zu jedem Dokument entstehen
+# gelabelte Fragen (erwarteter Dateiname) für Recall@k und MRR sowie ein
+# getrennter Satz anders formulierter Fragen für den Lasttest, damit dieser
+# nicht nur die Caches der Qualitätsmessung trifft.
+
+SYLLABLES = ["nor", "dal", "ber", "lin", "sto", "ka", "ven", "mar", "tel", "ros", "hei", "lun", "gra", "fel", "win", "tor"]
+FIRST_NAMES = ["Anna", "Jonas", "Lena", "Felix", "Marie", "Paul", "Sophie", "Lukas", "Clara", "Max", "Ida", "Emil"]
+TECHNOLOGIES = ["Photovoltaik", "Wärmepumpe", "Glasfaser", "Wasserstoff", "Brandmeldeanlage", "Lüftungsanlage",
+                "Spundwand", "Stahlbeton", "Holzständerbau", "Blockheizkraftwerk", "Regenwasserspeicher", "Ladeinfrastruktur"]
+FILLER = [
+    "Die Baustelle wird wöchentlich begangen und die Ergebnisse werden im Bautagebuch festgehalten.",
+    "Alle Gewerke stimmen sich in der Baubesprechung am Dienstag ab.",
+    "Für Arbeiten in der Höhe gilt die Unterweisung nach den Vorgaben der Berufsgenossenschaft.",
+    "Änderungen am Leistungsverzeichnis müssen vom Auftraggeber schriftlich freigegeben werden.",
+    "Die Abnahme erfolgt gemeinsam mit der Bauleitung und dem Sachverständigen.",
+    "Materiallieferungen werden am Vortag mit der Logistik abgestimmt.",
+    "Ersthelfer sind auf jeder Baustelle namentlich im Aushang benannt.",
+    "Mängel werden im Mängelmanagement erfasst und mit Fristen versehen.",
+]
+
+def unique_name(rng, used, parts=2):
+    # Nur 16² Namen mit zwei Silben: sind sie aufgebraucht, eine Silbe mehr nehmen
+    for attempt in range(10_000):
+        name = "".join(rng.choice(SYLLABLES) for _ in range(parts + attempt // 100)).capitalize()
+        if name not in used:
+            used.add(name)
+            return name
+
+def build_corpus(num_docs, seed=42, filler_paragraphs=6):
+    rng = random.Random(seed)
+    used = set()
+    documents, questions, load_questions = [], [], []
+    for _ in range(num_docs):
+        project = unique_name(rng, used, parts=3)
+        leader = f"{rng.choice(FIRST_NAMES)} {unique_name(rng, used)}"
+        city = unique_name(rng, used) + "hausen"
+        client = unique_name(rng, used) + " GmbH"
+        tech = rng.choice(TECHNOLOGIES)
+        budget = rng.randint(2, 90) * 100_000
+        filename = f"Projekt_{project}.md"
+
+        facts = [
+            f"Das Projekt {project} wird von {leader} geleitet.",
+            f"Das Projekt {project} befindet sich in {city}.",
+            f"Der Auftraggeber des Projekts {project} ist die {client}.",
+            f"Im Projekt {project} kommt {tech} zum Einsatz.",
+            f"Das Budget des Projekts {project} beträgt {budget} Euro.",
+        ]
+        filler = [" ".join(rng.sample(FILLER, 4)) for _ in range(filler_paragraphs)]
+        # Fakten zwischen den Fülltext streuen, damit sie in verschiedenen Chunks landen
+        body = []
+        for i, paragraph in enumerate(filler):
+            body.append(paragraph)
+            if i < len(facts):
+                body.append(facts[i])
+        text = f"# Projekt {project}\n\n" + "\n\n".join(body) + "\n"
+        documents.append((filename, text))
+
+        questions += [
+            {"question": f"Wer leitet das Projekt {project}?", "expected": filename},
+            {"question": f"Wo befindet sich das Projekt {project}?", "expected": filename},
+            {"question": f"Für welchen Auftraggeber arbeitet {leader}?", "expected": filename},
+            {"question": f"Welches Projekt wird in {city} umgesetzt?", "expected": filename},
+        ]
+        load_questions += [
+            {"question": f"Welche Technik kommt im Projekt {project} zum Einsatz?", "expected": filename},
+            {"question": f"Wie hoch ist das Budget des Projekts {project}?", "expected": filename},
+            {"question": f"Wer ist der Auftraggeber des Projekts {project}?", "expected": filename},
+            {"question": f"Welches Projekt leitet {leader}?", "expected": filename},
+            {"question": f"In welchem Ort liegt das Projekt {project}?", "expected": filename},
+            {"question": f"Welches Projekt hat die {client} beauftragt?", "expected": filename},
+        ]
+    rng.shuffle(questions)
+    rng.shuffle(load_questions)
+    return documents, questions, load_questions
+
+def write_questions(path, questions):
+    with open(path, "w", encoding="utf-8") as f:
+        for q in questions:
+            f.write(json.dumps(q, ensure_ascii=False) + "\n")
+
+def write_corpus(out_dir, num_docs, seed=42):
+    docs_dir = os.path.join(out_dir, "docs")
+    os.makedirs(docs_dir, exist_ok=True)
+    documents, questions, load_questions = build_corpus(num_docs, seed=seed)
+    for filename, text in documents:
+        with open(os.path.join(docs_dir, filename), "w", encoding="utf-8") as f:
+            f.write(text)
+    questions_path = os.path.join(out_dir, "questions.jsonl")
+    load_questions_path = os.path.join(out_dir, "load_questions.jsonl")
+    write_questions(questions_path, questions)
+    write_questions(load_questions_path, load_questions)
+    return docs_dir, questions_path, load_questions_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetischen Benchmark-Korpus erzeugen")
+    parser.add_argument("--out", default="benchmark/data")
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    docs_dir, questions_path, _ = write_corpus(args.out, args.docs, args.seed)
+    print(f"📄 {args.docs} Dokumente in {docs_dir}, Fragen in {questions_path}")
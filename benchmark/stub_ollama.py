@@ -0,0 +1,120 @@
+import os
+import re
+import json
+import asyncio
+import hashlib
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+# Deterministischer Ersatz für Ollama (Benchmark ohne GPU und ohne Netz).
+# Embeddings: gehashter Bag-of-Words, d.h. Texte mit gemeinsamen Wörtern liegen
+# nah beieinander und Recall-Messungen bleiben aussagekräftig.
+# Chat: erkennt die Prompts von Extraktion, Entitäten und Rewriting an ihren
+# Formulierungen und liefert passende, reproduzierbare Antworten.
+
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "1024"))
+STUB_EMBED_DELAY_MS = float(os.getenv("STUB_EMBED_DELAY_MS", "0"))   # simulierte Embedding-Dauer
+STUB_TOKEN_DELAY_MS = float(os.getenv("STUB_TOKEN_DELAY_MS", "0"))   # simulierte Dauer pro Antwort-Token
+STUB_ANSWER_TOKENS = int(os.getenv("STUB_ANSWER_TOKENS", "64"))
+
+app = FastAPI(title="Ollama-Stub")
+
+_UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", text.lower().translate(_UMLAUTS))
+
+def embed(text):
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    tokens = tokenize(text)
+    # Wörter plus Wortpaare, damit Reihenfolge eine kleine Rolle spielt
+    for feature in tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]:
+        h = int.from_bytes(hashlib.md5(feature.encode()).digest()[:8], "little")
+        vector[h % EMBEDDING_DIM] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+def entities(text):
+    # Folgen großgeschriebener Wörter als Entitäten ("Anna Berger", "Projekt Nordlicht")
+    found = re.findall(r"\b[A-ZÄÖÜ][\wäöüß-]+(?:\s+[A-ZÄÖÜ][\wäöüß-]+)*", text)
+    return [e for e in dict.fromkeys(found) if len(e) > 3]
+
+def extraction_answer(prompt):
+    text = prompt.rsplit("Text:", 1)[-1]
+    triples = []
+    for sentence in re.split(r"[.!?\n]", text):
+        names = entities(sentence)
+        for s, o in zip(names, names[1:]):
+            triples.append({"s": s, "s_type": "ENTITAET", "p": "steht in Beziehung zu", "o": o, "o_type": "ENTITAET", "confidence": 5})
+    return json.dumps({"triples": triples[:20]}, ensure_ascii=False)
+
+def chat_answer(messages):
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    if "Wissens-Tripel" in prompt:
+        return extraction_answer(prompt)
+    if "Hauptsubjekte" in prompt:
+        return ", ".join(entities(prompt.split("Frage:", 1)[-1])[:5])
+    if "umformulierte Suchanfrage" in prompt:
+        match = re.search(r"AKTUELLE FRAGE:\s*(.+?)\s*Antworte NUR", prompt, re.S)
+        return match.group(1).strip() if match else prompt[-200:]
+    words = (tokenize(prompt[-2000:]) or ["antwort"]) * STUB_ANSWER_TOKENS
+    return " ".join(words[:STUB_ANSWER_TOKENS])
+
+async def stream_chat(model, content, prompt_tokens, stream_tokens):
+    pieces = content.split(" ") if stream_tokens else [content]
+    for i, piece in enumerate(pieces):
+        if STUB_TOKEN_DELAY_MS:
+            await asyncio.sleep(STUB_TOKEN_DELAY_MS / 1000)
+        text = piece if i == 0 else " " + piece
+        yield json.dumps({"model": model, "message": {"role": "assistant", "content": text}, "done": False}) + "\n"
+    yield json.dumps({
+        "model": model,
+        "message": {"role": "assistant", "content": ""},
+        "done": True,
+        "prompt_eval_count": prompt_tokens,
+        "eval_count": len(pieces),
+    }) + "\n"
+
+@app.get("/api/tags")
+async def tags():
+    return {"models": [{"name": "stub"}]}
+
+@app.post("/api/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    if STUB_EMBED_DELAY_MS:
+        await asyncio.sleep(STUB_EMBED_DELAY_MS / 1000)
+    return {"embedding": embed(body.get("prompt", ""))}
+
+@app.post("/api/embed")
+async def embed_batch(request: Request):
+    body = await request.json()
+    inputs = body.get("input", "")
+    inputs = inputs if isinstance(inputs, list) else [inputs]
+    if STUB_EMBED_DELAY_MS:
+        await asyncio.sleep(STUB_EMBED_DELAY_MS / 1000)
+    return {"model": body.get("model"), "embeddings": [embed(t) for t in inputs]}
+
+@app.post("/api/chat")
+@app.post("/api/chat/")
+async def chat(request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    content = chat_answer(messages)
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4
+    # Nur freie Antworten Token für Token streamen; JSON-Antworten kommen am Stück
+    stream_tokens = not content.startswith("{")
+    generator = stream_chat(body.get("model"), content, prompt_tokens, stream_tokens)
+    if body.get("stream", True):
+        return StreamingResponse(generator, media_type="application/x-ndjson")
+    lines = [json.loads(line) async for line in generator]
+    final = lines[-1]
+    final["message"]["content"] = "".join(l["message"]["content"] for l in lines)
+    return final
+
+@app.post("/api/generate")
+async def generate(request: Request):
+    # Nur für Warm-up-Aufrufe (leerer Prompt mit keep_alive)
+    body = await request.json()
+    return {"model": body.get("model"), "response": "", "done": True}
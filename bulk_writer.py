@@ -0,0 +1,103 @@
+import uuid
+import numpy as np
+
+# Bulk-Schreiber für die Ingestion: sammelt alle Zeilen eines Dokuments und
+# überträgt sie per binärem COPY statt einzelner INSERT-Statements.
+# Parents und Chunks haben frische UUIDs und gehen direkt in die Zieltabellen;
+# Knoten und Kanten laufen über temporäre Staging-Tabellen (ohne WAL) und
+# werden anschließend mengenbasiert in den Graphen gemerged.
+
+# Temporäre Tabellen leben pro Sitzung, also einmal pro Pool-Verbindung
+STAGING_DDL = [
+    """CREATE TEMP TABLE IF NOT EXISTS staging_nodes (
+        id UUID, entity_name TEXT, entity_type TEXT
+    ) ON COMMIT DELETE ROWS""",
+    """CREATE TEMP TABLE IF NOT EXISTS staging_edges (
+        id UUID, source_node_id UUID, target_node_id UUID,
+        relation_type TEXT, source_doc_id UUID, confidence SMALLINT
+    ) ON COMMIT DELETE ROWS""",
+]
+
+MERGE_NODES_SQL = """
+    INSERT INTO document_nodes (id, entity_name, entity_type)
+    SELECT id, entity_name, entity_type FROM staging_nodes
+    ON CONFLICT (id) DO UPDATE SET
+        entity_type = EXCLUDED.entity_type
+    WHERE EXCLUDED.entity_type != 'UNKNOWN'
+"""
+
+MERGE_EDGES_SQL = """
+    INSERT INTO document_edges (id, source_node_id, target_node_id, relation_type, source_doc_id, confidence)
+    SELECT DISTINCT ON (source_node_id, target_node_id, relation_type, source_doc_id)
+        id, source_node_id, target_node_id, relation_type, source_doc_id, confidence
+    FROM staging_edges
+    ORDER BY source_node_id, target_node_id, relation_type, source_doc_id, confidence DESC
+    ON CONFLICT DO NOTHING
+"""
+
+def as_uuid(value):
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+class BulkWriter:
+    """Puffert Parents, Chunks, Knoten und Kanten eines Dokuments bis zum flush()."""
+
+    def __init__(self):
+        self.parents = []
+        self.chunks = []
+        self.nodes = {}   # id -> (name, typ), innerhalb des Batches dedupliziert
+        self.edges = []
+
+    def add_parent(self, p_id, title, full_text, source_url, metadata=None):
+        self.parents.append((as_uuid(p_id), title, full_text, source_url, metadata))
+
+    def add_chunk(self, c_id, parent_id, content, vector):
+        self.chunks.append((as_uuid(c_id), as_uuid(parent_id), content, np.asarray(vector, dtype=np.float32)))
+
+    def add_node(self, n_id, name, e_type):
+        n_id = as_uuid(n_id)
+        # Gleiche Semantik wie das frühere Einzel-Upsert: erster Name bleibt,
+        # ein bekannter Typ überschreibt UNKNOWN
+        if n_id not in self.nodes:
+            self.nodes[n_id] = (name, e_type)
+        elif e_type != "UNKNOWN":
+            self.nodes[n_id] = (self.nodes[n_id][0], e_type)
+
+    def add_edge(self, e_id, source_id, target_id, relation, doc_id, confidence):
+        self.edges.append((as_uuid(e_id), as_uuid(source_id), as_uuid(target_id), relation, as_uuid(doc_id), int(confidence)))
+
+    def flush(self, cur):
+        """Schreibt alle gepufferten Zeilen innerhalb der laufenden Transaktion."""
+        if self.parents:
+            with cur.copy("COPY parent_documents (id, title, full_text, source_url, metadata) FROM STDIN WITH (FORMAT BINARY)") as copy:
+                copy.set_types(["uuid", "text", "text", "text", "jsonb"])
+                for row in self.parents:
+                    copy.write_row(row)
+
+        if self.chunks:
+            with cur.copy("COPY document_chunks (id, parent_id, content, embedding) FROM STDIN WITH (FORMAT BINARY)") as copy:
+                copy.set_types(["uuid", "uuid", "text", "vector"])
+                for row in self.chunks:
+                    copy.write_row(row)
+
+        if self.nodes or self.edges:
+            for ddl in STAGING_DDL:
+                cur.execute(ddl, prepare=False)
+
+        if self.nodes:
+            with cur.copy("COPY staging_nodes (id, entity_name, entity_type) FROM STDIN WITH (FORMAT BINARY)") as copy:
+                copy.set_types(["uuid", "text", "text"])
+                for n_id, (name, e_type) in self.nodes.items():
+                    copy.write_row((n_id, name, e_type))
+            cur.execute(MERGE_NODES_SQL)
+
+        if self.edges:
+            with cur.copy("COPY staging_edges FROM STDIN WITH (FORMAT BINARY)") as copy:
+                copy.set_types(["uuid", "uuid", "uuid", "text", "uuid", "int2"])
+                for row in self.edges:
+                    copy.write_row(row)
+            cur.execute(MERGE_EDGES_SQL)
+
+        self.parents.clear()
+        self.chunks.clear()
+        self.nodes.clear()
+        self.edges.clear()
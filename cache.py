@@ -0,0 +1,163 @@
+import sys
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+
+# In-Process-Caches für die Engine: exakte Treffer (Embeddings, Entitäten)
+# und ein semantischer Cache über Query-Embeddings für fertige Suchergebnisse
+
+def estimate_size(value):
+    """Grobe Speicherschätzung in Bytes (für die Obergrenze pro Cache)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+def normalize_key(text):
+    return " ".join(str(text).lower().split())
+
+class TTLCache:
+    """LRU-Cache mit Ablaufzeit, Speicherobergrenze und Hit/Miss-Zählern."""
+
+    def __init__(self, name, max_entries=1000, ttl=3600, max_bytes=64 * 1024 * 1024):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self._bytes = 0
+        self._data = OrderedDict()  # key -> (ablauf, größe, wert)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, generation=None):
+        # Ergebnisse, die vor einer Invalidierung berechnet wurden, nicht mehr speichern
+        if generation is not None and generation != self.generation:
+            return
+        size = estimate_size(key) + estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self.generation += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def _evict(self):
+        while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+            key = next(iter(self._data))
+            self._remove(key)
+            self.evictions += 1
+
+class SemanticCache(TTLCache):
+    """
+    Cache für Suchergebnisse über normierte Query-Embeddings. Ein Treffer liegt vor,
+    wenn die Kosinus-Ähnlichkeit zu einer gespeicherten Anfrage >= threshold ist.
+    """
+
+    def __init__(self, name, threshold=0.97, **kwargs):
+        super().__init__(name, **kwargs)
+        self.threshold = threshold
+        # Zeile i der Matrix gehört zu _keys[i]; wird bei set/_remove direkt gepflegt
+        self._keys = []
+        self._rows = {}
+        self._matrix = None
+
+    def lookup(self, vector):
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            best = -1
+            if self._keys:
+                sims = self._matrix[:len(self._keys)] @ query
+                best = int(np.argmax(sims))
+                if sims[best] < self.threshold:
+                    best = -1
+            key = self._keys[best] if best >= 0 else None
+        if key is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        return self.get(key)
+
+    def add(self, vector, value, generation=None):
+        key = np.asarray(vector, dtype=np.float32)
+        key = key / (np.linalg.norm(key) or 1.0)
+        self.set(key.tobytes(), value, generation=generation)
+
+    def _append_row(self, key):
+        row = np.frombuffer(key, dtype=np.float32)
+        n = len(self._keys)
+        if self._matrix is None or self._matrix.shape[1] != row.shape[0]:
+            self._matrix = np.zeros((16, row.shape[0]), dtype=np.float32)
+        elif n == self._matrix.shape[0]:
+            # Kapazität verdoppeln statt bei jedem Insert neu zu stapeln
+            self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+        self._matrix[n] = row
+        self._rows[key] = n
+        self._keys.append(key)
+
+    def _remove(self, key):
+        super()._remove(key)
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        # Letzte Zeile in die Lücke verschieben
+        last_key = self._keys.pop()
+        if last_key != key:
+            self._matrix[row] = self._matrix[len(self._keys)]
+            self._keys[row] = last_key
+            self._rows[last_key] = row
+
+    def set(self, key, value, generation=None):
+        super().set(key, value, generation=generation)
+        with self._lock:
+            if key in self._data and key not in self._rows:
+                self._append_row(key)
+
+    def clear(self):
+        super().clear()
+        with self._lock:
+            self._keys = []
+            self._rows = {}
+            self._matrix = None
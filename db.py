@@ -0,0 +1,126 @@
+import os
+import asyncio
+import logging
+import psycopg
+from dotenv import load_dotenv
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
+from pgvector.psycopg import register_vector, register_vector_async
+
+# Gemeinsame Verbindungsschicht für engine.py (async) und ingestion.py (sync)
+load_dotenv()
+logger = logging.getLogger("rag.db")
+
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))          # Sekunden Wartezeit auf eine freie Verbindung
+POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "600"))       # Ungenutzte Verbindungen nach 10 Min. schließen
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))
+# Ab wie vielen Ausführungen psycopg ein Statement serverseitig vorbereitet (0 = sofort)
+PREPARE_THRESHOLD = int(os.getenv("DB_PREPARE_THRESHOLD", "5"))
+
+# NOTIFY-Kanal, über den die Ingestion das Backend über neue/ersetzte Dokumente informiert
+CORPUS_CHANNEL = "corpus_changed"
+
+_pool = None
+_async_pool = None
+
+def get_conninfo():
+    return make_conninfo(
+        dbname=os.getenv("POSTGRES_DB"),
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        host=os.getenv("POSTGRES_HOST"),
+        port=os.getenv("POSTGRES_PORT")
+    )
+
+def _configure(conn):
+    # pgvector-Typen einmal pro Verbindung registrieren
+    register_vector(conn)
+    conn.commit()
+
+async def _configure_async(conn):
+    await register_vector_async(conn)
+    await conn.commit()
+
+def get_pool():
+    """Synchroner Pool (Ingestion). Wird beim ersten Zugriff geöffnet."""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(
+            get_conninfo(),
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            timeout=POOL_TIMEOUT,
+            max_idle=POOL_MAX_IDLE,
+            max_lifetime=POOL_MAX_LIFETIME,
+            kwargs={"prepare_threshold": PREPARE_THRESHOLD},
+            configure=_configure,
+            check=ConnectionPool.check_connection,
+            name="rag-sync",
+            open=True,
+        )
+    return _pool
+
+def get_async_pool():
+    """Asynchroner Pool (API). Muss vor der Nutzung mit open_async_pool() geöffnet werden."""
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = AsyncConnectionPool(
+            get_conninfo(),
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            timeout=POOL_TIMEOUT,
+            max_idle=POOL_MAX_IDLE,
+            max_lifetime=POOL_MAX_LIFETIME,
+            kwargs={"prepare_threshold": PREPARE_THRESHOLD},
+            configure=_configure_async,
+            check=AsyncConnectionPool.check_connection,
+            name="rag-async",
+            open=False,
+        )
+    return _async_pool
+
+async def open_async_pool():
+    await get_async_pool().open()
+
+async def close_async_pool():
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+def notify_corpus_changed(cur, title=None):
+    # Wird erst beim COMMIT zugestellt, also nie für halb geschriebene Dokumente.
+    # Ohne Titel (nach Löschungen) baut das Backend sein Wörterbuch komplett neu auf
+    cur.execute("SELECT pg_notify(%s, %s)", (CORPUS_CHANNEL, title or ""))
+
+async def listen_corpus_changes(on_change, retry_delay=5):
+    """
+    Hört dauerhaft auf CORPUS_CHANNEL und ruft on_change(payload) auf.
+    Nach einem Verbindungsabbruch wird neu verbunden und on_change(None)
+    aufgerufen, weil in der Zwischenzeit Änderungen verpasst worden sein können.
+    """
+    connected_before = False
+    while True:
+        try:
+            conn = await psycopg.AsyncConnection.connect(get_conninfo(), autocommit=True)
+            async with conn:
+                await conn.execute(f"LISTEN {CORPUS_CHANNEL}")
+                # Beim ersten Verbinden lädt bereits das Warm-up, erst nach einem Abbruch nachladen
+                if connected_before:
+                    on_change(None)
+                connected_before = True
+                async for notify in conn.notifies():
+                    on_change(notify.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("⚠️ NOTIFY-Listener getrennt (%s), neuer Versuch in %ss", e, retry_delay)
+        await asyncio.sleep(retry_delay)
@@ -1,173 +1,756 @@
 import os
-import psycopg2
+import re
+import asyncio
+import logging
+import httpx
+import numpy as np
 import urllib.parse
 from dotenv import load_dotenv
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_community.chat_models import ChatOllama # NEU: Für lokale Modelle
-from flashrank import Ranker, RerankRequest
+from db import get_async_pool, open_async_pool, close_async_pool, listen_corpus_changes
+from cache import TTLCache, SemanticCache, normalize_key
+from entities import EntityMatcher, build_matcher, fetch_all_names, fetch_document_names
+from graph_index import GraphIndex, load_graph_index
+from reranker import RerankService
+from metrics import span, record_llm_usage, register_cache_stats
 
 # SETUP
 load_dotenv()
+logger = logging.getLogger("rag.engine")
+
+# Ollama-Adresse (im Docker-Netz der Container "ollama"; der Benchmark setzt hier einen Stub ein)
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://ollama:11434")
+LLM_MODEL = os.getenv("LLM_MODEL", "qwen2.5:32b")
+# Kleines Modell für Rewriting und Routing (z.B. qwen2.5:3b); Standard = LLM_MODEL ohne zweites Modell
+FAST_LLM_MODEL = os.getenv("FAST_LLM_MODEL") or LLM_MODEL
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "mxbai-embed-large")
+# Wie lange Ollama die Modelle nach einer Anfrage im (GPU-)Speicher hält; -1 = dauerhaft
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "-1")
+
+def keep_alive_value(value):
+    # Ollama erwartet Sekunden als Zahl oder eine Dauer wie "30m"
+    return int(value) if value.lstrip("-").isdigit() else value
 
 def load_models():
-    # Cache-Dir für Docker optimiert
-    ranker = Ranker(model_name="ms-marco-MultiBERT-L-12", cache_dir="/app/models/flashrank")
+    # Erzeugt nur die Clients, lädt aber noch keine Modelle: Der Cross-Encoder wird beim
+    # Warm-up bzw. ersten Re-Ranking geladen, die Ollama-Modelle beim Warm-up (siehe warm_up)
+    # Cross-Encoder als Dienst mit Micro-Batching (Modell über RERANK_MODEL, Cache-Dir für Docker optimiert)
+    # Er ist CPU-gebunden und läuft in einem eigenen Thread-Pool, damit er den Event-Loop nicht blockiert
+    reranker = RerankService()
     
     # LLM: OLLAMA 
-    llm = ChatOllama(model="qwen2.5:32b", base_url="http://ollama:11434", temperature=0.1,num_ctx=32768)
-    extraction_llm = ChatOllama(model="qwen2.5:32b", base_url="http://ollama:11434", temperature=0,num_ctx=8192)
+    keep_alive = keep_alive_value(OLLAMA_KEEP_ALIVE)
+    llm = ChatOllama(model=LLM_MODEL, base_url=OLLAMA_BASE_URL, temperature=0.1,num_ctx=32768, keep_alive=keep_alive)
+    extraction_llm = ChatOllama(model=LLM_MODEL, base_url=OLLAMA_BASE_URL, temperature=0,num_ctx=8192, keep_alive=keep_alive)
+    # Gleiches Modell mit anderem num_ctx würde Ollama neu laden, daher dann dasselbe Objekt
+    if FAST_LLM_MODEL == LLM_MODEL:
+        fast_llm = llm
+    else:
+        fast_llm = ChatOllama(model=FAST_LLM_MODEL, base_url=OLLAMA_BASE_URL, temperature=0,num_ctx=4096, keep_alive=keep_alive)
     
     # LLM: OPENAI 
     #llm = ChatOpenAI(model="gpt-4o", temperature=0.1)
     #extraction_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+    #fast_llm = extraction_llm
 
     # EMBEDDINGS: OLLAMA LOKAL  
     # Nutzt mxbai-embed-large oder nomic-embed-text (beide sehr gut für RAG)
     from langchain_community.embeddings import OllamaEmbeddings
-    embeddings = OllamaEmbeddings(model="mxbai-embed-large", base_url="http://ollama:11434",num_ctx=8192)
+    embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL,num_ctx=8192)
 
     # EMBEDDINGS: OPENAI 
     #embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
     
-    return ranker, llm, extraction_llm, embeddings
+    return reranker, llm, extraction_llm, fast_llm, embeddings
+
+reranker, llm, extraction_llm, fast_llm, embeddings_model = load_models()
+
+# CACHES
+# Embeddings und Entitäten hängen nur von der Frage ab; fertige Suchergebnisse
+# hängen vom Datenbestand ab und werden bei jeder Ingestion verworfen
+CACHE_TTL = float(os.getenv("CACHE_TTL", "3600"))
+CACHE_MAX_MB = float(os.getenv("CACHE_MAX_MB", "64"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.97"))
+
+embedding_cache = TTLCache("embeddings", max_entries=5000, ttl=CACHE_TTL, max_bytes=int(CACHE_MAX_MB * 1024 * 1024))
+entity_cache = TTLCache("entities", max_entries=5000, ttl=CACHE_TTL, max_bytes=int(CACHE_MAX_MB * 1024 * 1024))
+# Umformulierte Fragen pro Gesprächsverlauf und Routing-Entscheidungen hängen nicht vom Datenbestand ab
+rewrite_cache = TTLCache("rewrites", max_entries=5000, ttl=CACHE_TTL, max_bytes=int(CACHE_MAX_MB * 1024 * 1024))
+route_cache = TTLCache("routes", max_entries=5000, ttl=CACHE_TTL, max_bytes=int(CACHE_MAX_MB * 1024 * 1024))
+result_cache = SemanticCache(
+    "results",
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    max_entries=1000,
+    ttl=CACHE_TTL,
+    max_bytes=int(CACHE_MAX_MB * 1024 * 1024),
+)
+
+# BEREITSCHAFT
+# Die API nimmt sofort Verbindungen an; /ready meldet erst Bereitschaft, wenn
+# Wörterbuch, Graph-Index, Cross-Encoder und Ollama-Modelle geladen sind
+readiness = {"entities": False, "graph": False, "reranker": False, "llm": False, "fast_llm": False, "embeddings": False}
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "600"))        # Sekunden für das Laden eines Ollama-Modells
+WARMUP_RETRY_DELAY = float(os.getenv("WARMUP_RETRY_DELAY", "10"))
+
+# ENTITÄTEN
+# Bekannte Knotennamen als Wörterbuch im Speicher; das Extraktions-LLM wird nur
+# noch gefragt, wenn keine bekannte Entität in der Frage vorkommt (und es erlaubt ist)
+ENTITY_LLM_FALLBACK = os.getenv("ENTITY_LLM_FALLBACK", "false").lower() in ("1", "true", "yes")
+entity_matcher = EntityMatcher()
+_background_tasks = set()
+
+async def reload_entities(title=None):
+    """
+    Ohne Titel (Start, Reconnect, Löschungen): Matcher komplett neu aufbauen.
+    Mit Titel: nur die Knoten dieses Dokuments ergänzen.
+    """
+    global entity_matcher
+    try:
+        if not title:
+            rows, total_docs = await fetch_all_names(get_async_pool())
+            # Aufbau im Thread, der fertige Matcher wird atomar ausgetauscht
+            entity_matcher = await asyncio.to_thread(build_matcher, rows, total_docs)
+            readiness["entities"] = True
+            logger.info("🔤 Entitäts-Wörterbuch geladen: %d Namen (%d Allgemeinbegriffe übersprungen)",
+                        entity_matcher.entries, entity_matcher.skipped)
+        else:
+            for node_id, name, docs in await fetch_document_names(get_async_pool(), title):
+                entity_matcher.add(name, node_id, docs)
+    except Exception as e:
+        logger.warning("⚠️ Entitäts-Wörterbuch nicht aktualisiert: %s", e)
+
+# WISSENSGRAPH
+# Snapshot von Knoten und Kanten im Speicher; nach Ingestion-Ereignissen wird er
+# verzögert neu aufgebaut, damit ein Ingestion-Lauf nur wenige Neuaufbauten auslöst
+GRAPH_LIMIT = int(os.getenv("GRAPH_LIMIT", "30"))
+GRAPH_RELOAD_DELAY = float(os.getenv("GRAPH_RELOAD_DELAY", "5"))
+graph_index = GraphIndex()
+_graph_reload_task = None
+_graph_dirty = False
+
+async def reload_graph(delay=0.0):
+    global graph_index, _graph_dirty
+    while True:
+        await asyncio.sleep(delay)
+        _graph_dirty = False
+        try:
+            node_rows, edge_rows = await load_graph_index(get_async_pool())
+            graph_index = await asyncio.to_thread(GraphIndex, node_rows, edge_rows)
+            readiness["graph"] = True
+            logger.info("🕸️ Graph-Index geladen: %d Knoten, %d Kanten", len(graph_index.node_ids), graph_index.edges)
+        except Exception as e:
+            logger.warning("⚠️ Graph-Index nicht aktualisiert: %s", e)
+        # Während des Ladens eingetroffene Änderungen noch einmal nachziehen
+        if not _graph_dirty:
+            return
+
+def schedule_graph_reload():
+    global _graph_reload_task, _graph_dirty
+    _graph_dirty = True
+    if _graph_reload_task is None or _graph_reload_task.done():
+        _graph_reload_task = asyncio.create_task(reload_graph(GRAPH_RELOAD_DELAY))
+
+def invalidate_caches(payload):
+    # payload = Dateiname aus der Ingestion, leer nach Löschungen, None nach Wiederverbindung des Listeners
+    result_cache.clear()
+    if payload:
+        logger.info("♻️ Ergebnis-Cache geleert (neu indexiert: %s)", payload)
+    task = asyncio.create_task(reload_entities(payload))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    schedule_graph_reload()
+
+def cache_stats():
+    stats = {c.name: c.stats() for c in (embedding_cache, entity_cache, rewrite_cache, route_cache, result_cache, reranker.scores)}
+    stats["reranker"] = reranker.stats()
+    return stats
+
+# Cache-Statistiken bei jedem Scrape von /metrics mitliefern
+register_cache_stats(cache_stats)
+
+_listener_task = None
+_warmup_task = None
+
+async def warm_up_ollama(name, path, payload):
+    """Lädt ein Ollama-Modell per Dummy-Anfrage (mit keep_alive) und wiederholt bis zum Erfolg."""
+    async with httpx.AsyncClient(base_url=OLLAMA_BASE_URL, timeout=WARMUP_TIMEOUT) as client:
+        while True:
+            try:
+                with span("engine", f"warmup_{name}"):
+                    response = await client.post(path, json=payload)
+                    response.raise_for_status()
+                readiness[name] = True
+                logger.info("🔥 Ollama-Modell '%s' geladen", payload["model"])
+                return
+            except httpx.HTTPError as e:
+                logger.warning("⚠️ Warm-up '%s' fehlgeschlagen (%s), neuer Versuch in %ss", name, e, WARMUP_RETRY_DELAY)
+                await asyncio.sleep(WARMUP_RETRY_DELAY)
+
+async def warm_up_index(name, load):
+    """Lädt Wörterbuch bzw. Graph-Index und wiederholt, bis die Datenbank erreichbar ist."""
+    while True:
+        await load()
+        if readiness[name]:
+            return
+        logger.warning("⚠️ Warm-up '%s' fehlgeschlagen, neuer Versuch in %ss", name, WARMUP_RETRY_DELAY)
+        await asyncio.sleep(WARMUP_RETRY_DELAY)
+
+async def warm_up_reranker():
+    try:
+        with span("engine", "warmup_reranker"):
+            await reranker.warm_up()
+        readiness["reranker"] = True
+    except Exception as e:
+        logger.warning("⚠️ Cross-Encoder konnte nicht geladen werden: %s", e)
+
+async def warm_up():
+    """Alle Modelle und Indizes parallel laden, damit die erste echte Frage keine Ladezeit zahlt."""
+    keep_alive = keep_alive_value(OLLAMA_KEEP_ALIVE)
+    tasks = [warm_up_index("entities", reload_entities), warm_up_index("graph", reload_graph), warm_up_reranker()]
+    # Gleiche Optionen wie die echten Anfragen, sonst lädt Ollama das Modell mit anderem num_ctx neu
+    if isinstance(llm, ChatOllama):
+        tasks.append(warm_up_ollama("llm", "/api/generate", {
+            "model": llm.model, "prompt": "Hallo", "stream": False, "keep_alive": keep_alive,
+            "options": {"num_ctx": llm.num_ctx, "num_predict": 1},
+        }))
+    else:
+        readiness["llm"] = True
+    if fast_llm is not llm and isinstance(fast_llm, ChatOllama):
+        tasks.append(warm_up_ollama("fast_llm", "/api/generate", {
+            "model": fast_llm.model, "prompt": "Hallo", "stream": False, "keep_alive": keep_alive,
+            "options": {"num_ctx": fast_llm.num_ctx, "num_predict": 1},
+        }))
+    else:
+        readiness["fast_llm"] = True
+    if hasattr(embeddings_model, "query_instruction"):
+        tasks.append(warm_up_ollama("embeddings", "/api/embed", {
+            "model": embeddings_model.model, "input": "Hallo", "keep_alive": keep_alive,
+            "options": {"num_ctx": embeddings_model.num_ctx},
+        }))
+    else:
+        readiness["embeddings"] = True
+    started = asyncio.get_running_loop().time()
+    await asyncio.gather(*tasks)
+    if all(readiness.values()):
+        logger.info("✅ Backend bereit (Warm-up %.1fs)", asyncio.get_running_loop().time() - started)
+    else:
+        logger.warning("⚠️ Warm-up unvollständig: %s", [k for k, v in readiness.items() if not v])
+
+async def check_ready():
+    """Bereitschaft für /ready: Warm-up abgeschlossen und Datenbank erreichbar."""
+    components = dict(readiness)
+    # Im Multi-Worker-Betrieb kann der Reranker-Prozess nach dem Warm-up ausfallen
+    components["reranker"] = readiness["reranker"] and await reranker.check()
+    try:
+        async with get_async_pool().connection(timeout=2) as conn:
+            await conn.execute("SELECT 1")
+        components["database"] = True
+    except Exception:
+        components["database"] = False
+    return all(components.values()), components
+
+async def startup():
+    global _listener_task, _warmup_task
+    # Verbindungspool beim Start der API öffnen (wartet nicht auf die Datenbank)
+    await open_async_pool()
+    reranker.start()
+    # Auf Ingestion-Ereignisse hören, um veraltete Cache-Einträge zu verwerfen
+    # und Wörterbuch sowie Graph-Index nachzuziehen
+    _listener_task = asyncio.create_task(listen_corpus_changes(invalidate_caches))
+    # Modelle und Indizes im Hintergrund laden; uvicorn nimmt währenddessen schon Verbindungen an
+    _warmup_task = asyncio.create_task(warm_up())
+
+async def shutdown():
+    if _warmup_task is not None:
+        _warmup_task.cancel()
+    if _listener_task is not None:
+        _listener_task.cancel()
+    if _graph_reload_task is not None:
+        _graph_reload_task.cancel()
+    await close_async_pool()
+    await reranker.stop()
 
-ranker, llm, extraction_llm, embeddings_model = load_models()
+# VEKTORSUCHE
+# full:    HNSW direkt auf embedding (vector, float32)
+# halfvec: HNSW auf embedding::halfvec (halber Index-Speicher), danach exaktes Re-Scoring
+# binary:  HNSW auf binary_quantize(embedding) (1 Bit pro Dimension, Hamming-Distanz),
+#          danach exaktes Re-Scoring einer größeren Shortlist
+# Die passenden Indizes legt VektorErweiterung.sql (Abschnitt 9) an
+VECTOR_MODE = os.getenv("VECTOR_MODE", "full").lower()
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "1024"))
+VECTOR_CANDIDATES = int(os.getenv("VECTOR_CANDIDATES", "60"))   # Treffer der Vektorsuche für die Rank Fusion
+VECTOR_SHORTLIST = int(os.getenv("VECTOR_SHORTLIST", "240"))    # Kandidaten der ersten (quantisierten) Stufe
+# Suchtiefe des HNSW-Index pro Anfrage; muss mindestens so groß sein wie die Kandidatenzahl
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "100"))
 
-def get_connection():
-    return psycopg2.connect(
-        dbname=os.getenv("POSTGRES_DB"),
-        user=os.getenv("POSTGRES_USER"),
-        password=os.getenv("POSTGRES_PASSWORD"),
-        host=os.getenv("POSTGRES_HOST"),
-        port=os.getenv("POSTGRES_PORT")
-    )
+VECTOR_SEARCH_SQL = {
+    "full": """
+            SELECT id, ROW_NUMBER() OVER (ORDER BY distance) AS rnk
+            FROM (
+                SELECT c.id, c.embedding <=> {vec} AS distance
+                FROM document_chunks c
+                ORDER BY distance
+                LIMIT %(candidates)s
+            ) v""",
+    "halfvec": """
+            SELECT id, ROW_NUMBER() OVER (ORDER BY distance) AS rnk
+            FROM (
+                SELECT s.id, s.embedding <=> {vec} AS distance
+                FROM (
+                    SELECT c.id, c.embedding
+                    FROM document_chunks c
+                    ORDER BY c.embedding::halfvec({dim}) <=> {vec}::halfvec({dim})
+                    LIMIT %(shortlist)s
+                ) s
+                ORDER BY distance
+                LIMIT %(candidates)s
+            ) v""",
+    "binary": """
+            SELECT id, ROW_NUMBER() OVER (ORDER BY distance) AS rnk
+            FROM (
+                SELECT s.id, s.embedding <=> {vec} AS distance
+                FROM (
+                    SELECT c.id, c.embedding
+                    FROM document_chunks c
+                    ORDER BY binary_quantize(c.embedding)::bit({dim}) <~> binary_quantize({vec})
+                    LIMIT %(shortlist)s
+                ) s
+                ORDER BY distance
+                LIMIT %(candidates)s
+            ) v""",
+}
+
+if VECTOR_MODE not in VECTOR_SEARCH_SQL:
+    raise ValueError(f"Unbekannter VECTOR_MODE '{VECTOR_MODE}' (erlaubt: {', '.join(VECTOR_SEARCH_SQL)})")
+
+# ef_search gilt nur für die laufende Transaktion (set_config(..., true) = SET LOCAL)
+EF_SEARCH_SQL = "SELECT set_config('hnsw.ef_search', %s, true)"
+
+# SQL-Statements als Konstanten: psycopg bereitet sie pro Verbindung einmal
+# serverseitig vor (prepare=True), statt sie bei jeder Anfrage neu zu parsen
+# Vektor-Suche (HNSW) und Volltextsuche (GIN auf content_tsv) liefern je eine
+# Rangliste; Reciprocal Rank Fusion führt beide zusammen und entfernt Duplikate.
+# Bis zum Re-Ranking werden nur Chunk-IDs und Chunk-Text übertragen
+HYBRID_SEARCH_TEMPLATE = """
+        WITH vector_search AS ({vector_search}
+        ),
+        keyword_search AS (
+            SELECT id, ROW_NUMBER() OVER (ORDER BY rank DESC) AS rnk
+            FROM (
+                SELECT c.id, ts_rank_cd(c.content_tsv, kq.query) AS rank
+                FROM document_chunks c, {tsquery} AS kq(query)
+                WHERE c.content_tsv @@ kq.query
+                ORDER BY rank DESC
+                LIMIT 30
+            ) k
+        ),
+        fused AS (
+            SELECT id, SUM(1.0 / (%(rrf_k)s + rnk)) AS score
+            FROM (
+                SELECT id, rnk FROM vector_search
+                UNION ALL
+                SELECT id, rnk FROM keyword_search
+            ) u
+            GROUP BY id
+            ORDER BY score DESC
+            LIMIT %(limit)s
+        )
+        SELECT c.id, c.parent_id, c.content, f.score
+        FROM fused f
+        JOIN document_chunks c ON c.id = f.id
+        ORDER BY f.score DESC
+"""
 
-def extract_entities_universal(question):
+def hybrid_search_sql(vec, tsquery):
+    vector_search = VECTOR_SEARCH_SQL[VECTOR_MODE].format(vec=vec, dim=EMBEDDING_DIM)
+    return HYBRID_SEARCH_TEMPLATE.format(vector_search=vector_search, tsquery=tsquery)
+
+HYBRID_SEARCH_SQL = hybrid_search_sql("%(vec)s::vector", "to_tsquery('german', %(tsquery)s)")
+
+# Batch-Variante: dieselbe Suche für viele Fragen in einem Roundtrip,
+# je Frage (Vektor, tsquery) eine LATERAL-Ausführung
+BATCH_SEARCH_SQL = """
+    SELECT q.ord, r.id, r.parent_id, r.content, r.score
+    FROM unnest(%(vecs)s::vector[], %(tsqueries)s::text[]) WITH ORDINALITY AS q(vec, tsq, ord)
+    CROSS JOIN LATERAL ({search}) r
+    ORDER BY q.ord, r.score DESC
+""".format(search=hybrid_search_sql("q.vec", "to_tsquery('german', q.tsq)"))
+
+# Phase 2: Nur die Parents der Gewinner-Chunks laden, jeden genau einmal
+PARENTS_SQL = """
+    SELECT id, title, source_url, full_text
+    FROM parent_documents
+    WHERE id = ANY(%s::uuid[])
+"""
+
+# Konstante der Rank Fusion und Anzahl Kandidaten, die an den Reranker gehen
+RRF_K = int(os.getenv("RRF_K", "60"))
+FUSION_CANDIDATES = int(os.getenv("FUSION_CANDIDATES", "40"))
+
+# Anzahl Chunks nach dem Re-Ranking und Token-Budget für den TEXT-KONTEXT im Prompt
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "8"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+
+# Zeitbudgets pro Stufe (Sekunden). Optionale Stufen fallen nach Ablauf auf
+# einen Ersatzwert zurück, statt die ganze Antwort aufzuhalten
+REWRITE_TIMEOUT = float(os.getenv("STAGE_TIMEOUT_REWRITE", "20"))
+EMBED_TIMEOUT = float(os.getenv("STAGE_TIMEOUT_EMBED", "30"))
+ENTITY_TIMEOUT = float(os.getenv("STAGE_TIMEOUT_ENTITIES", "10"))
+
+async def run_stage(name, awaitable, timeout, fallback):
+    """Wartet höchstens `timeout` Sekunden auf eine Stufe und liefert sonst den Fallback."""
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        logger.warning("⚠️ Stufe '%s' nach %ss abgebrochen, nutze Fallback.", name, timeout)
+    except Exception as e:
+        logger.warning("⚠️ Fehler in Stufe '%s': %s", name, e)
+    return fallback
+
+async def extract_entities_universal(question):
     prompt = f"""Extrahiere die Hauptsubjekte (Personen, Firmen, Organisationen) aus der Frage. 
     Nenne für Organisationen auch bekannte Kurzformen oder alternative Bezeichnungen.
     Frage: '{question}'
     Antworte NUR als kommagetrennte Liste ohne Einleitung."""
+    key = normalize_key(question)
+    cached = entity_cache.get(key)
+    if cached is not None:
+        return cached
     try:
-        res = extraction_llm.invoke(prompt)
+        with span("engine", "entity_llm"):
+            res = await extraction_llm.ainvoke(prompt)
+        record_llm_usage("entities", res)
         # res.content funktioniert bei Ollama genau wie bei OpenAI
-        return [e.strip() for e in res.content.split(",") if e.strip()]
+        entities = [e.strip() for e in res.content.split(",") if e.strip()]
     except Exception as e:
-        print(f"⚠️ Fehler bei Extraktion: {e}")
+        logger.warning("⚠️ Fehler bei Extraktion: %s", e)
         return []
+    entity_cache.set(key, entities)
+    return entities
+
+async def embed_query(text):
+    key = normalize_key(text)
+    vector = embedding_cache.get(key)
+    if vector is None:
+        with span("engine", "embed"):
+            vector = np.array(await embeddings_model.aembed_query(text), dtype=np.float32)
+        embedding_cache.set(key, vector)
+    return vector
+
+async def embed_queries(texts):
+    """Embeddings mehrerer Fragen; alle nicht gecachten in einem einzigen Aufruf."""
+    keys = [normalize_key(t) for t in texts]
+    vectors = [embedding_cache.get(k) for k in keys]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        with span("engine", "batch_embed"):
+            new_vectors = await _embed_batch([texts[i] for i in missing])
+        for i, vector in zip(missing, new_vectors):
+            vectors[i] = np.array(vector, dtype=np.float32)
+            embedding_cache.set(keys[i], vectors[i])
+    return vectors
+
+async def _embed_batch(texts):
+    # OllamaEmbeddings (langchain_community) schickt pro Text eine eigene Anfrage;
+    # /api/embed nimmt dagegen alle Texte in einem POST. Präfix wie bei embed_query
+    if not hasattr(embeddings_model, "query_instruction"):
+        return await embeddings_model.aembed_documents(texts)
+    payload = {
+        "model": embeddings_model.model,
+        "input": [f"{embeddings_model.query_instruction}{t}" for t in texts],
+        "keep_alive": keep_alive_value(OLLAMA_KEEP_ALIVE),
+        "options": {"num_ctx": embeddings_model.num_ctx},
+    }
+    async with httpx.AsyncClient(base_url=OLLAMA_BASE_URL, timeout=EMBED_TIMEOUT) as client:
+        response = await client.post("/api/embed", json=payload)
+        response.raise_for_status()
+        return response.json()["embeddings"]
 
-def search_hybrid_graph(question):
-    # 1. SCHLAGWORTE EXTRAHIEREN (Wichtig für die Suche!)
+def extract_keywords(question):
     # Wir nehmen die Wörter aus der Frage, die länger als 4 Buchstaben sind
     search_terms = [w.strip("?!.,").lower() for w in question.split() if len(w) > 4]
     # Falls die Frage sehr kurz ist, nehmen wir alles
     if not search_terms:
         search_terms = [question.lower()]
-    
-    # Bereite die SQL-Suche vor: ["%ersthelfer%", "%schnoor%", ...]
-    sql_keywords = [f"%{t}%" for t in search_terms]
+    return search_terms
 
-    # 2. Embedding für die semantische Suche
-    query_vector = embeddings_model.embed_query(question)
-    
-    conn = get_connection()
-    cur = conn.cursor()
-
-    # STUFE 1: Hybrid-Suche (Vektor + Keyword ANY Boost)
-    # Wir suchen jetzt nach Chunks, die IRGENDEINES der Schlagworte enthalten
-    cur.execute("""
-        WITH vector_search AS (
-            SELECT 
-                p.full_text as parent_text, 
-                p.title, 
-                p.source_url, 
-                p.id as p_id, 
-                c.content, 
-                (1 - (c.embedding <=> %s::vector)) as similarity
-            FROM document_chunks c
-            JOIN parent_documents p ON c.parent_id = p.id
-            ORDER BY c.embedding <=> %s::vector
-            LIMIT 60 
-        ),
-        keyword_search AS (
-            SELECT 
-                p.full_text as parent_text, 
-                p.title, 
-                p.source_url, 
-                p.id as p_id, 
-                c.content,
-                1.0 as similarity 
-            FROM document_chunks c
-            JOIN parent_documents p ON c.parent_id = p.id
-            WHERE c.content ILIKE ANY(%s)  -- FINDET JETZT "Ersthelfer" sicher!
-               OR p.full_text ILIKE ANY(%s)
-            LIMIT 30
-        )
-        SELECT * FROM vector_search
-        UNION ALL
-        SELECT * FROM keyword_search
-    """, (query_vector, query_vector, sql_keywords, sql_keywords))
-    
-    rows = cur.fetchall()
+def build_tsquery(question):
+    # ODER-Verknüpfung mit Präfix-Suche: "ersthelf:* | schnoor:*"
+    # findet auch zusammengesetzte Wörter wie "Ersthelferausbildung"
+    words = [w.lower() for w in re.findall(r"[^\W_]+", question) if len(w) > 2]
+    return " | ".join(f"{w}:*" for w in dict.fromkeys(words))
 
-    # Passages für den Reranker aufbereiten
+def estimate_tokens(text):
+    # Grobe Schätzung ohne Tokenizer: ca. 4 Zeichen pro Token
+    return len(text) // 4 + 1
+
+async def fetch_parents(parent_ids):
+    async with get_async_pool().connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(PARENTS_SQL, (parent_ids,), prepare=True)
+            return {str(r[0]): r for r in await cur.fetchall()}
+
+def pack_context(top_results, parents, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Fasst Chunks mit gleichem Parent zusammen (bester Score zählt) und packt die
+    Parent-Texte in absteigender Relevanz, bis das Token-Budget erschöpft ist.
+    Gibt den Kontext-Text und die IDs der verwendeten Parents zurück.
+    """
+    merged = {}
+    for res in top_results:
+        p_id = res['meta']['p_id']
+        score = float(res.get('score', 0.0))
+        if p_id not in merged or score > merged[p_id]:
+            merged[p_id] = score
+
+    context_text = ""
+    doc_ids = []
+    remaining = budget
+    for p_id, _ in sorted(merged.items(), key=lambda x: x[1], reverse=True):
+        if p_id not in parents:
+            continue
+        _, title, url, full_text = parents[p_id]
+        safe_url = urllib.parse.quote(url, safe=':/?&=')
+        header = f"\n--- QUELLE: {title} ---\nURL: {safe_url}\nINHALT:\n"
+        cost = estimate_tokens(header) + estimate_tokens(full_text)
+        if cost > remaining:
+            # Letzten Parent kürzen, wenn noch nennenswert Platz ist
+            room = (remaining - estimate_tokens(header)) * 4
+            if room < 200:
+                break
+            full_text = full_text[:room] + " [...]"
+            cost = remaining
+        context_text += f"{header}{full_text}\n"
+        doc_ids.append(p_id)
+        remaining -= cost
+        if remaining <= 0:
+            break
+    return context_text, doc_ids
+
+def build_passages(rows):
     passages = []
-    for r in rows:
+    for c_id, p_id, content, fusion_score in rows:
         passages.append({
-            "id": str(len(passages)),
-            "text": r[4], # c.content
+            "id": str(c_id), # nach der Fusion bereits eindeutig
+            "text": content,
             "meta": {
-                "title": r[1],
-                "url": r[2],
-                "p_id": str(r[3]),
-                "parent_text": r[0]
+                "p_id": str(p_id),
+                "fusion_score": float(fusion_score)
             }
         })
+    return passages
 
-    if not passages:
-        cur.close()
-        conn.close()
-        return "Keine relevanten Dokumente gefunden.", "Keine Graph-Daten."
+def format_graph(triples):
+    if not triples:
+        return "Keine spezifischen Graph-Verknüpfungen gefunden."
+    return "".join(f"- {s} {p} {o} (Typ: {o_type})\n" for s, p, o, o_type in triples)
 
-    # STUFE 2: Re-Ranking (Der Reranker entscheidet, was wirklich wichtig ist)
-    rerank_results = ranker.rerank(RerankRequest(query=question, passages=passages))
-    top_results = rerank_results[:8] # Wir nehmen 8 für mehr Sicherheit
+async def find_seed_nodes(question):
+    """Knoten-IDs, von denen aus der Graph expandiert wird."""
+    with span("engine", "entities"):
+        node_ids = entity_matcher.match(question)
+        if node_ids:
+            return node_ids
 
-    context_text = ""
-    doc_ids = []
-    for res in top_results:
-        meta = res['meta']
-        safe_url = urllib.parse.quote(meta['url'], safe=':/?&=')
-        doc_ids.append(meta['p_id'])
-        context_text += f"\n--- QUELLE: {meta['title']} ---\nURL: {safe_url}\nINHALT:\n{meta['parent_text']}\n"
-
-    # STUFE 3: Graph-Scan (Bleibt wie gehabt)
-    search_terms_graph = extract_entities_universal(question)
-    sql_terms_graph = [f"%{t}%" for t in search_terms_graph] if search_terms_graph else sql_keywords
-    
-    graph_knowledge = ""
-    graph_query = """
-    SELECT DISTINCT n1.entity_name, e.relation_type, n2.entity_name, n2.entity_type
-    FROM document_edges e
-    JOIN document_nodes n1 ON e.source_node_id = n1.id
-    JOIN document_nodes n2 ON e.target_node_id = n2.id
-    WHERE (
-        e.source_doc_id = ANY(%s::uuid[]) 
-        OR n1.entity_name ILIKE ANY(%s) 
-        OR n2.entity_name ILIKE ANY(%s)
-    )
-    AND e.confidence >= 3
-    LIMIT 30;
+        # Keine bekannte Entität: Namen per LLM (optional) oder Schlagworte im Graphen suchen
+        search_terms_graph = []
+        if ENTITY_LLM_FALLBACK:
+            search_terms_graph = await run_stage("Entitäten", extract_entities_universal(question), ENTITY_TIMEOUT, [])
+        terms = search_terms_graph or extract_keywords(question)
+        return await asyncio.to_thread(graph_index.find_nodes, terms)
+
+async def search_hybrid_graph(question, rewrite=None):
+    """
+    Retrieval als Stufen-Graph:
+    Entitätserkennung, Query-Rewriting (optional, als Awaitable übergeben) und
+    Embedding starten parallel; der Graph wird nach dem Re-Ranking im Speicher expandiert.
     """
-    cur.execute(graph_query, (doc_ids, sql_terms_graph, sql_terms_graph))
-    triples = cur.fetchall()
+    # Stand des Ergebnis-Caches merken: Wird währenddessen neu indexiert,
+    # landet dieses (evtl. veraltete) Ergebnis nicht mehr im Cache
+    generation = result_cache.generation
+
+    # STUFE 0: Unabhängige Stufen sofort starten
+    seed_task = asyncio.create_task(find_seed_nodes(question))
+
+    try:
+        # Das Embedding braucht die umformulierte Frage, die Entitäten nicht
+        search_query = question
+        if rewrite is not None:
+            with span("engine", "rewrite_wait"):
+                search_query = await run_stage("Rewriting", rewrite, REWRITE_TIMEOUT, question) or question
+
+        # 1. SCHLAGWORTE EXTRAHIEREN (Wichtig für die Suche!)
+        tsquery = build_tsquery(search_query)
+
+        # 2. Embedding für die semantische Suche
+        query_vector = await asyncio.wait_for(embed_query(search_query), EMBED_TIMEOUT)
+
+        # Semantischer Cache: (fast) gleiche Frage schon beantwortet?
+        with span("engine", "result_cache"):
+            cached = result_cache.lookup(query_vector)
+        if cached is not None:
+            seed_task.cancel()
+            return cached
     
-    if triples:
-        for s, p, o, o_type in triples:
-            graph_knowledge += f"- {s} {p} {o} (Typ: {o_type})\n"
-    else:
-        graph_knowledge = "Keine spezifischen Graph-Verknüpfungen gefunden."
+        # STUFE 1: Hybrid-Suche (Vektor + Volltext, per Rank Fusion kombiniert)
+        params = {
+            "vec": query_vector,
+            "tsquery": tsquery,
+            "rrf_k": RRF_K,
+            "limit": FUSION_CANDIDATES,
+            "candidates": VECTOR_CANDIDATES,
+            "shortlist": VECTOR_SHORTLIST,
+        }
+        ef_search = max(HNSW_EF_SEARCH, VECTOR_CANDIDATES if VECTOR_MODE == "full" else VECTOR_SHORTLIST)
+        with span("engine", "sql"):
+            async with get_async_pool().connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(EF_SEARCH_SQL, (str(ef_search),), prepare=True)
+                    await cur.execute(HYBRID_SEARCH_SQL, params, prepare=True)
+                    rows = await cur.fetchall()
+    except BaseException:
+        seed_task.cancel()
+        raise
 
-    cur.close()
-    conn.close()
+    # Passages für den Reranker aufbereiten
+    passages = build_passages(rows)
+
+    if not passages:
+        seed_task.cancel()
+        result = ("Keine relevanten Dokumente gefunden.", "Keine Graph-Daten.")
+        result_cache.add(query_vector, result, generation=generation)
+        return result
+
+    # STUFE 2: Re-Ranking (Der Reranker entscheidet, was wirklich wichtig ist)
+    # Gleichzeitige Anfragen teilen sich die Forward-Passes des Cross-Encoders
+    with span("engine", "rerank"):
+        top_results = await reranker.rerank(search_query, passages, top_k=RERANK_TOP_K) # Standard 8 für mehr Sicherheit
+
+    # Phase 2: Eindeutige Parents der Gewinner laden und ins Token-Budget packen
+    with span("engine", "parents"):
+        parent_ids = list(dict.fromkeys(res['meta']['p_id'] for res in top_results))
+        parents = await fetch_parents(parent_ids)
+        context_text, doc_ids = pack_context(top_results, parents)
+
+    # STUFE 3: Graph-Expansion ab den erkannten Entitäten und den Kontext-Dokumenten,
+    # nach Relevanz sortiert (Kanten aus den Kontext-Dokumenten zählen mehr)
+    seeds = await run_stage("Entitäten", seed_task, ENTITY_TIMEOUT, [])
+    with span("engine", "graph"):
+        # CPU-gebunden, daher im Thread statt auf dem Event-Loop
+        triples = await asyncio.to_thread(graph_index.expand, seeds, doc_ids, limit=GRAPH_LIMIT)
+
+    graph_knowledge = format_graph(triples)
+    result_cache.add(query_vector, (context_text, graph_knowledge), generation=generation)
     return context_text, graph_knowledge
 
+# BATCH-SUCHE (Evaluation, Massenabfragen)
+# Fragen werden in Blöcken verarbeitet; pro Block ein Embedding-Aufruf und ein
+# SQL-Roundtrip, mehrere Blöcke laufen überlappend
+QUERY_BATCH_CHUNK = int(os.getenv("QUERY_BATCH_CHUNK", "32"))
+QUERY_BATCH_PARALLEL = int(os.getenv("QUERY_BATCH_PARALLEL", "2"))
+
+async def _search_block(questions):
+    """Sucht einen Block von Fragen; Ergebnisse in derselben Reihenfolge wie die Fragen."""
+    generation = result_cache.generation
+    seed_tasks = [asyncio.create_task(find_seed_nodes(q)) for q in questions]
+    results = [None] * len(questions)
+    rows = {}
+    try:
+        vectors = await embed_queries(questions)
+        with span("engine", "result_cache"):
+            for i, vector in enumerate(vectors):
+                results[i] = result_cache.lookup(vector)
+                if results[i] is None:
+                    rows[i] = []
+                else:
+                    seed_tasks[i].cancel()
+
+        # STUFE 1: Alle Hybrid-Suchen des Blocks in einem Roundtrip
+        pending = list(rows)
+        if pending:
+            params = {
+                "vecs": [vectors[i] for i in pending],
+                "tsqueries": [build_tsquery(questions[i]) for i in pending],
+                "rrf_k": RRF_K,
+                "limit": FUSION_CANDIDATES,
+                "candidates": VECTOR_CANDIDATES,
+                "shortlist": VECTOR_SHORTLIST,
+            }
+            ef_search = max(HNSW_EF_SEARCH, VECTOR_CANDIDATES if VECTOR_MODE == "full" else VECTOR_SHORTLIST)
+            with span("engine", "batch_sql"):
+                async with get_async_pool().connection() as conn:
+                    async with conn.cursor() as cur:
+                        await cur.execute(EF_SEARCH_SQL, (str(ef_search),), prepare=True)
+                        await cur.execute(BATCH_SEARCH_SQL, params, prepare=True)
+                        for position, *row in await cur.fetchall():
+                            rows[pending[position - 1]].append(row)
+    except BaseException:
+        for task in seed_tasks:
+            task.cancel()
+        raise
+
+    # STUFE 2: Re-Ranking aller Fragen gleichzeitig, der Reranker bündelt sie zu gemeinsamen Forward-Passes
+    with span("engine", "batch_rerank"):
+        ranked = await asyncio.gather(*[
+            reranker.rerank(questions[i], build_passages(rows[i]), top_k=RERANK_TOP_K) for i in pending
+        ])
+    top_results = dict(zip(pending, ranked))
+
+    # Parents aller Gewinner einmal laden
+    with span("engine", "batch_parents"):
+        parent_ids = list(dict.fromkeys(res['meta']['p_id'] for top in ranked for res in top))
+        parents = await fetch_parents(parent_ids) if parent_ids else {}
+
+    # STUFE 3: Graph-Expansion; die Breitensuche pro Seed-Knoten wird über den Block geteilt,
+    # auch wenn sich die Seeds der Fragen nur überschneiden
+    seed_cache = {}
+    for i in pending:
+        if not top_results[i]:
+            seed_tasks[i].cancel()
+            results[i] = ("Keine relevanten Dokumente gefunden.", "Keine Graph-Daten.")
+        else:
+            context_text, doc_ids = pack_context(top_results[i], parents)
+            seeds = await run_stage("Entitäten", seed_tasks[i], ENTITY_TIMEOUT, [])
+            with span("engine", "graph"):
+                triples = await asyncio.to_thread(graph_index.expand, seeds, doc_ids, limit=GRAPH_LIMIT, seed_cache=seed_cache)
+            results[i] = (context_text, format_graph(triples))
+        result_cache.add(vectors[i], results[i], generation=generation)
+    return results
+
+async def search_hybrid_graph_batch(questions):
+    """
+    Retrieval für viele Fragen auf einmal. Liefert (Index, Ergebnis) in der Reihenfolge
+    der Fertigstellung; Ergebnis ist (Kontext, Graph) oder die Exception des Blocks.
+    """
+    # Gleiche Fragen nur einmal suchen
+    groups = {}
+    for i, question in enumerate(questions):
+        groups.setdefault(normalize_key(question), (question, []))[1].append(i)
+    unique = list(groups.values())
+
+    done = asyncio.Queue()
+    slots = asyncio.Semaphore(QUERY_BATCH_PARALLEL)
+
+    async def run_block(block):
+        async with slots:
+            try:
+                results = await _search_block([question for question, _ in block])
+            except Exception as e:
+                logger.warning("⚠️ Fehler in der Batch-Suche: %s", e)
+                results = [e] * len(block)
+        for (_, indices), result in zip(block, results):
+            done.put_nowait((indices, result))
+
+    tasks = [
+        asyncio.create_task(run_block(unique[start:start + QUERY_BATCH_CHUNK]))
+        for start in range(0, len(unique), QUERY_BATCH_CHUNK)
+    ]
+    try:
+        for _ in range(len(unique)):
+            indices, result = await done.get()
+            for i in indices:
+                yield i, result
+    finally:
+        for task in tasks:
+            task.cancel()
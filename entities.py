@@ -0,0 +1,182 @@
+import os
+import re
+import unicodedata
+import psycopg
+
+# Wörterbuch-basierte Entitätserkennung für den Graph-Scan.
+# Alle Knotennamen aus document_nodes (plus Aliase) liegen als Token-Trie im
+# Speicher; eine Frage wird in einem Durchlauf gegen alle bekannten Namen
+# gematcht, statt pro Frage das Extraktions-LLM aufzurufen.
+
+# Rechtsformen, die für den Alias ohne Rechtsform abgeschnitten werden
+# ("Schnoor GmbH & Co. KG" -> "Schnoor"); Vergleich auf normalisierten Tokens
+LEGAL_FORMS = {
+    "gmbh", "mbh", "ag", "kg", "kgaa", "ohg", "gbr", "ug", "se", "ev", "eg",
+    "co", "inc", "ltd", "llc", "plc", "corp", "sa", "bv", "nv",
+}
+
+# Einzelne Tokens, die kürzer sind, erzeugen zu viele Zufallstreffer
+MIN_SINGLE_TOKEN_LEN = 3
+MAX_MATCHES = 50
+
+# Die LLM-Extraktion legt auch Knoten wie "Die", "und" oder "Projekt" an. Solche Namen
+# würden fast jede Frage treffen; ein Name braucht mindestens ein Token außerhalb dieser Liste
+STOPWORDS = {
+    "der", "die", "das", "den", "dem", "des", "ein", "eine", "einer", "eines", "einem", "einen",
+    "und", "oder", "aber", "doch", "sondern", "denn", "als", "wie", "wenn", "dass", "ob", "weil",
+    "in", "im", "an", "am", "auf", "aus", "bei", "mit", "nach", "von", "vom", "zu", "zum", "zur",
+    "fuer", "ueber", "unter", "vor", "hinter", "neben", "zwischen", "durch", "gegen", "ohne", "um", "bis",
+    "ich", "du", "er", "sie", "es", "wir", "ihr", "mein", "dein", "sein", "unser", "euer",
+    "ist", "sind", "war", "waren", "wird", "werden", "wurde", "hat", "haben", "hatte", "kann", "muss", "soll",
+    "nicht", "kein", "keine", "auch", "noch", "nur", "schon", "sehr", "mehr", "alle", "alles", "jede", "jeder",
+    "wer", "was", "wo", "wann", "warum", "welche", "welcher", "welches", "hier", "dort", "dies", "diese", "dieser",
+    "the", "and", "for", "with", "from",
+}
+GENERIC_TERMS = {
+    "projekt", "projekte", "firma", "unternehmen", "dokument", "dokumente", "person", "personen",
+    "mitarbeiter", "kunde", "kunden", "auftraggeber", "ort", "stadt", "datum", "jahr", "thema",
+    "budget", "kosten", "technik", "leitung", "team", "abteilung", "bereich", "system", "anlage",
+}
+
+# Namen, die in mehr als diesem Anteil der Dokumente vorkommen, gelten als Allgemeinbegriff
+# und werden nicht ins Wörterbuch übernommen (mindestens ENTITY_MIN_DOC_CAP Dokumente erlaubt)
+ENTITY_MAX_DOC_SHARE = float(os.getenv("ENTITY_MAX_DOC_SHARE", "0.2"))
+ENTITY_MIN_DOC_CAP = int(os.getenv("ENTITY_MIN_DOC_CAP", "5"))
+
+_UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+
+# (ID, Name, Anzahl Dokumente) aller Knoten mit Kanten; Knoten ohne Kanten liefern keine Seeds
+ALL_NODES_SQL = """
+    SELECT n.id, n.entity_name, count(DISTINCT e.source_doc_id)
+    FROM document_edges e
+    CROSS JOIN LATERAL (VALUES (e.source_node_id), (e.target_node_id)) AS v(node_id)
+    JOIN document_nodes n ON n.id = v.node_id
+    GROUP BY n.id, n.entity_name
+"""
+
+DOC_COUNT_SQL = "SELECT count(*) FROM parent_documents"
+
+# Nur die Knoten eines (neu) indexierten Dokuments, für das inkrementelle Nachladen
+DOC_NODES_SQL = """
+    WITH doc_nodes AS (
+        SELECT e.source_node_id AS node_id FROM parent_documents p
+        JOIN document_edges e ON e.source_doc_id = p.id WHERE p.title = %s
+        UNION
+        SELECT e.target_node_id FROM parent_documents p
+        JOIN document_edges e ON e.source_doc_id = p.id WHERE p.title = %s
+    )
+    SELECT n.id, n.entity_name,
+           (SELECT count(DISTINCT e.source_doc_id) FROM document_edges e
+            WHERE e.source_node_id = n.id OR e.target_node_id = n.id)
+    FROM doc_nodes d
+    JOIN document_nodes n ON n.id = d.node_id
+"""
+
+# Optionale, gepflegte Aliase (Tabelle entity_aliases, siehe VektorErweiterung.sql);
+# sie sind bewusst gewählt und fallen nie unter die Dokument-Obergrenze
+ALIASES_SQL = "SELECT node_id, alias, 0 FROM entity_aliases WHERE %s::uuid[] IS NULL OR node_id = ANY(%s::uuid[])"
+
+def normalize_tokens(text):
+    """Kleinschreibung, Umlaute ausschreiben, Akzente entfernen, in Wort-Tokens zerlegen."""
+    text = str(text).lower().translate(_UMLAUTS)
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    # "e.V." -> "ev", "S.A." -> "sa"
+    text = re.sub(r"\b(\w)\.(?=\w\b)", r"\1", text)
+    return tuple(re.findall(r"[a-z0-9]+", text))
+
+def is_informative(token):
+    return len(token) >= MIN_SINGLE_TOKEN_LEN and not token.isdigit() and token not in STOPWORDS and token not in GENERIC_TERMS
+
+def name_variants(name):
+    """Normalisierter Name und, falls vorhanden, derselbe Name ohne Rechtsform."""
+    tokens = normalize_tokens(name)
+    variants = {tokens}
+    stripped = list(tokens)
+    while len(stripped) > 1 and stripped[-1] in LEGAL_FORMS:
+        stripped.pop()
+    if len(stripped) < len(tokens):
+        variants.add(tuple(stripped))
+    return {v for v in variants if any(is_informative(t) for t in v)}
+
+def max_docs_per_name(total_docs):
+    return max(ENTITY_MIN_DOC_CAP, int(total_docs * ENTITY_MAX_DOC_SHARE))
+
+class EntityMatcher:
+    """Token-Trie über alle bekannten Entitätsnamen (längster Treffer gewinnt)."""
+
+    _END = ""  # Schlüssel für die Knoten-IDs am Ende eines Namens; echte Tokens sind nie leer
+
+    def __init__(self, max_docs=None):
+        self._root = {}
+        self.entries = 0
+        self.skipped = 0
+        self.max_docs = max_docs
+
+    def add(self, name, node_id, docs=0):
+        # Knoten aus sehr vielen Dokumenten ("Deutschland", "Angebot") sind als Seed wertlos
+        if self.max_docs is not None and docs > self.max_docs:
+            self.skipped += 1
+            return
+        for tokens in name_variants(name):
+            node = self._root
+            for token in tokens:
+                node = node.setdefault(token, {})
+            ids = node.setdefault(self._END, set())
+            if node_id not in ids:
+                ids.add(node_id)
+                self.entries += 1
+
+    def match(self, text):
+        """Gibt die Knoten-IDs aller Namen zurück, die in `text` vorkommen (links-längste Treffer)."""
+        tokens = normalize_tokens(text)
+        found = []
+        i = 0
+        while i < len(tokens) and len(found) < MAX_MATCHES:
+            node = self._root
+            best_end, best_ids = i, None
+            for j in range(i, len(tokens)):
+                node = node.get(tokens[j])
+                if node is None:
+                    break
+                if self._END in node:
+                    best_end, best_ids = j + 1, node[self._END]
+            if best_ids:
+                found.extend(best_ids)
+                i = best_end
+            else:
+                i += 1
+        return list(dict.fromkeys(found))[:MAX_MATCHES]
+
+async def fetch_aliases(conn, node_ids=None):
+    # Die Alias-Tabelle ist optional; fehlt sie, wird ohne Aliase gearbeitet
+    try:
+        async with conn.transaction():
+            cur = await conn.execute(ALIASES_SQL, (node_ids, node_ids))
+            return await cur.fetchall()
+    except psycopg.errors.UndefinedTable:
+        return []
+
+async def fetch_all_names(pool):
+    """(Knoten-ID, Name, Anzahl Dokumente) für alle Knoten und Aliase sowie die Gesamtzahl der Dokumente."""
+    async with pool.connection() as conn:
+        cur = await conn.execute(ALL_NODES_SQL)
+        rows = await cur.fetchall()
+        rows += await fetch_aliases(conn)
+        cur = await conn.execute(DOC_COUNT_SQL)
+        total_docs = (await cur.fetchone())[0]
+    return rows, total_docs
+
+async def fetch_document_names(pool, title):
+    """(Knoten-ID, Name, Anzahl Dokumente) für die Knoten eines Dokuments und deren Aliase."""
+    async with pool.connection() as conn:
+        cur = await conn.execute(DOC_NODES_SQL, (title, title), prepare=True)
+        rows = await cur.fetchall()
+        if rows:
+            rows += await fetch_aliases(conn, [r[0] for r in rows])
+    return rows
+
+def build_matcher(rows, total_docs=0):
+    matcher = EntityMatcher(max_docs=max_docs_per_name(total_docs))
+    for node_id, name, docs in rows:
+        matcher.add(name, node_id, docs)
+    return matcher
@@ -0,0 +1,200 @@
+import os
+import numpy as np
+
+# Kompakter Wissensgraph im Speicher des Backends (CSR-Adjazenz über numpy-Arrays).
+# Ersetzt die Graph-SQL-Abfragen pro Frage: Nachbarschaft und k-Hop-Expansion
+# laufen ohne Datenbank-Roundtrip, Hubs werden nach Relevanz gewichtet statt
+# per LIMIT abgeschnitten. Neu aufgebaut wird nach Ingestion-Ereignissen (engine.py).
+
+GRAPH_HOPS = int(os.getenv("GRAPH_HOPS", "2"))
+GRAPH_MIN_CONFIDENCE = int(os.getenv("GRAPH_MIN_CONFIDENCE", "3"))
+GRAPH_RELATION_FANOUT = int(os.getenv("GRAPH_RELATION_FANOUT", "5"))  # Kanten pro Knoten und Relation
+GRAPH_NODE_FANOUT = int(os.getenv("GRAPH_NODE_FANOUT", "20"))         # Kanten pro Knoten insgesamt
+GRAPH_HOP_DECAY = float(os.getenv("GRAPH_HOP_DECAY", "0.5"))          # Gewicht pro weiterem Hop
+GRAPH_DOC_BOOST = float(os.getenv("GRAPH_DOC_BOOST", "1.0"))          # Bonus für Kanten aus den gefundenen Dokumenten
+
+NODES_SQL = "SELECT id, entity_name, entity_type FROM document_nodes"
+EDGES_SQL = """
+    SELECT source_node_id, target_node_id, relation_type, source_doc_id, confidence
+    FROM document_edges
+    WHERE confidence >= %s
+"""
+
+def build_csr(keys, values, size, order_by=None):
+    """Gruppiert `values` nach `keys` (0..size-1); innerhalb einer Gruppe absteigend nach `order_by`."""
+    sort_keys = (keys,) if order_by is None else (-order_by, keys)
+    order = np.lexsort(sort_keys)
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=size), out=indptr[1:])
+    return indptr, values[order]
+
+def group_ranks(groups):
+    """Rang jedes Elements innerhalb seiner Gruppe, in der bestehenden Reihenfolge (0, 1, 2, ...)."""
+    order = np.argsort(groups, kind="stable")
+    sorted_groups = groups[order]
+    starts = np.r_[0, np.flatnonzero(sorted_groups[1:] != sorted_groups[:-1]) + 1]
+    counts = np.diff(np.r_[starts, len(groups)])
+    ranks = np.empty(len(groups), dtype=np.int64)
+    ranks[order] = np.arange(len(groups)) - np.repeat(starts, counts)
+    return ranks
+
+def top_edges_per_node(nodes, edges, rel, conf, n_relations, min_confidence, relation_fanout, node_fanout):
+    """
+    Aus einer nach (Knoten, Gewicht absteigend) sortierten Adjazenz die besten Kanten je Knoten:
+    höchstens `relation_fanout` pro Relation und `node_fanout` insgesamt.
+    """
+    mask = conf[edges] >= min_confidence
+    nodes, edges = nodes[mask], edges[mask]
+    keep = group_ranks(nodes.astype(np.int64) * max(n_relations, 1) + rel[edges]) < relation_fanout
+    nodes, edges = nodes[keep], edges[keep]
+    keep = group_ranks(nodes) < node_fanout
+    return nodes[keep], edges[keep]
+
+class GraphIndex:
+    """
+    Unveränderlicher Snapshot des Graphen; wird bei Änderungen komplett ersetzt.
+    expand() ist CPU-gebunden und sollte im Backend per asyncio.to_thread laufen.
+    """
+
+    def __init__(self, node_rows=(), edge_rows=()):
+        self.node_ids = [r[0] for r in node_rows]
+        self.node_index = {n_id: i for i, n_id in enumerate(self.node_ids)}
+        self.names = [r[1] for r in node_rows]
+        self.types = [r[2] for r in node_rows]
+        self._lower_names = [str(n).lower() for n in self.names]
+
+        edge_rows = [r for r in edge_rows if r[0] in self.node_index and r[1] in self.node_index]
+        relations, docs = {}, {}
+        self.src = np.fromiter((self.node_index[r[0]] for r in edge_rows), dtype=np.int32, count=len(edge_rows))
+        self.dst = np.fromiter((self.node_index[r[1]] for r in edge_rows), dtype=np.int32, count=len(edge_rows))
+        self.rel = np.fromiter((relations.setdefault(r[2], len(relations)) for r in edge_rows), dtype=np.int32, count=len(edge_rows))
+        self.doc = np.fromiter((docs.setdefault(str(r[3]), len(docs)) for r in edge_rows), dtype=np.int32, count=len(edge_rows))
+        self.conf = np.fromiter((r[4] or 0 for r in edge_rows), dtype=np.int16, count=len(edge_rows))
+        self.relations = list(relations)
+        self.doc_index = docs
+
+        n_nodes, n_edges = len(self.node_ids), len(edge_rows)
+        edge_ids = np.arange(n_edges, dtype=np.int32)
+        # Ungerichtete Adjazenz: jede Kante steht bei beiden Endpunkten
+        endpoints = np.concatenate([self.src, self.dst])
+        self.degree = np.bincount(endpoints, minlength=n_nodes)
+
+        # Relevanz einer Kante: Confidence, abgewertet nach dem Grad beider Endpunkte.
+        # Ein Hub wie "Deutschland" liefert viele, aber wenig aussagekräftige Kanten
+        self.weight = (self.conf / (np.log2(2 + self.degree[self.src]) * np.log2(2 + self.degree[self.dst]))).astype(np.float32)
+
+        both = np.concatenate([edge_ids, edge_ids])
+        self.adj_ptr, self.adj_edges = build_csr(endpoints, both, n_nodes, order_by=self.weight[both])
+        self.doc_ptr, self.doc_edges = build_csr(self.doc, edge_ids, len(docs), order_by=self.weight)
+
+        # Auswahl der Breitensuche für die Standard-Parameter vorab berechnen: pro Knoten
+        # nur noch die besten Kanten, auch bei Hubs mit Tausenden Kanten einer Relation
+        adj_nodes = np.repeat(np.arange(n_nodes, dtype=np.int32), np.diff(self.adj_ptr))
+        self.top_params = (GRAPH_MIN_CONFIDENCE, GRAPH_RELATION_FANOUT, GRAPH_NODE_FANOUT)
+        top_nodes, self.top_edges = top_edges_per_node(
+            adj_nodes, self.adj_edges, self.rel, self.conf, len(self.relations), *self.top_params)
+        self.top_ptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(top_nodes, minlength=n_nodes), out=self.top_ptr[1:])
+
+    @property
+    def edges(self):
+        return len(self.src)
+
+    def find_nodes(self, terms, per_term=10):
+        """Teilstring-Suche über Knotennamen (Fallback ohne Wörterbuch-Treffer), Hubs zuerst."""
+        found = []
+        for term in terms:
+            term = term.lower()
+            hits = [i for i, name in enumerate(self._lower_names) if term in name]
+            hits.sort(key=lambda i: self.degree[i], reverse=True)
+            found.extend(self.node_ids[i] for i in hits[:per_term])
+        return list(dict.fromkeys(found))
+
+    def neighbour_edges(self, n, min_confidence, relation_fanout, node_fanout):
+        """Die relevantesten Kanten eines Knotens für die Breitensuche."""
+        if (min_confidence, relation_fanout, node_fanout) == self.top_params:
+            return self.top_edges[self.top_ptr[n]:self.top_ptr[n + 1]]
+        edges = self.adj_edges[self.adj_ptr[n]:self.adj_ptr[n + 1]]
+        nodes = np.zeros(len(edges), dtype=np.int32)
+        return top_edges_per_node(nodes, edges, self.rel, self.conf, len(self.relations),
+                                  min_confidence, relation_fanout, node_fanout)[1]
+
+    def seed_scores(self, n, hops, min_confidence, relation_fanout, node_fanout):
+        """
+        Breitensuche ab einem Seed-Knoten: Kante -> Gewicht mal Hop-Abschlag (ohne Dokument-Bonus).
+        Das Maximum über die Seeds ergibt dasselbe wie eine gemeinsame Breitensuche,
+        daher lassen sich die Ergebnisse pro Seed wiederverwenden (Batch-Suche).
+        """
+        scores = {}
+        frontier, visited = [n], {n}
+        factor = 1.0
+        for _ in range(hops):
+            next_frontier = []
+            for m in frontier:
+                for e in self.neighbour_edges(m, min_confidence, relation_fanout, node_fanout):
+                    e = int(e)
+                    score = float(self.weight[e]) * factor
+                    if score > scores.get(e, 0.0):
+                        scores[e] = score
+                    other = int(self.dst[e] if self.src[e] == m else self.src[e])
+                    if other not in visited:
+                        visited.add(other)
+                        next_frontier.append(other)
+            frontier = next_frontier
+            factor *= GRAPH_HOP_DECAY
+        return scores
+
+    def expand(self, seeds=(), doc_ids=(), hops=GRAPH_HOPS, limit=30,
+               min_confidence=GRAPH_MIN_CONFIDENCE,
+               relation_fanout=GRAPH_RELATION_FANOUT, node_fanout=GRAPH_NODE_FANOUT, seed_cache=None):
+        """
+        Sammelt Kanten der gefundenen Dokumente und die k-Hop-Nachbarschaft der
+        Seed-Knoten, bewertet sie und gibt die besten `limit` Tripel zurück:
+        [(subjekt, relation, objekt, objekt_typ), ...]
+        seed_cache (dict) hält die Breitensuche pro Seed über mehrere Aufrufe mit denselben Parametern.
+        """
+        docs = {self.doc_index[str(d)] for d in doc_ids if str(d) in self.doc_index}
+        scores = {}
+
+        def consider(e, score):
+            if self.doc[e] in docs:
+                score *= 1.0 + GRAPH_DOC_BOOST
+            if score > scores.get(e, 0.0):
+                scores[e] = score
+
+        # 1. Kanten aus den Dokumenten, die es in den Kontext geschafft haben
+        for d in docs:
+            for e in self.doc_edges[self.doc_ptr[d]:self.doc_ptr[d + 1]]:
+                if self.conf[e] >= min_confidence:
+                    consider(int(e), float(self.weight[e]))
+
+        # 2. Breitensuche ab den Seeds; pro Knoten nur die relevantesten Kanten je Relation
+        for n in dict.fromkeys(self.node_index[s] for s in seeds if s in self.node_index):
+            if seed_cache is not None and n in seed_cache:
+                found = seed_cache[n]
+            else:
+                found = self.seed_scores(n, hops, min_confidence, relation_fanout, node_fanout)
+                if seed_cache is not None:
+                    seed_cache[n] = found
+            for e, score in found.items():
+                consider(e, score)
+
+        # Gleicher Fakt aus mehreren Dokumenten zählt einmal (mit dem besten Score);
+        # bei gleichem Score entscheidet die Kante, unabhängig von der Reihenfolge der Seeds
+        triples = {}
+        for e, score in sorted(scores.items(), key=lambda x: (-x[1], x[0])):
+            s, o = self.src[e], self.dst[e]
+            triple = (self.names[s], self.relations[self.rel[e]], self.names[o], self.types[o])
+            triples.setdefault(triple, score)
+            if len(triples) >= limit:
+                break
+        return list(triples)
+
+async def load_graph_index(pool, min_confidence=GRAPH_MIN_CONFIDENCE):
+    """Lädt Knoten und Kanten; der Aufbau der Arrays sollte im Thread laufen."""
+    async with pool.connection() as conn:
+        cur = await conn.execute(NODES_SQL)
+        node_rows = await cur.fetchall()
+        cur = await conn.execute(EDGES_SQL, (min_confidence,))
+        edge_rows = await cur.fetchall()
+    return node_rows, edge_rows
@@ -1,13 +1,24 @@
 import os
+import time
 import uuid
 import json
-import psycopg2
+import hashlib
+import queue
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
 from dotenv import load_dotenv
+from psycopg.types.json import Jsonb
 from docling.document_converter import DocumentConverter
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.chat_models import ChatOllama
 from langchain_community.embeddings import OllamaEmbeddings
+from db import get_pool, close_pool, notify_corpus_changed
+from bulk_writer import BulkWriter
+from jobs import StageError, with_retry, start_job, save_checkpoint, finish_job, fail_job, load_unfinished_jobs
+from metrics import Timings, span, observe, record_llm_usage, export_batch_metrics
 
 # 1. SETUP
 load_dotenv()
@@ -21,24 +32,16 @@ SUPPORTED_EXTENSIONS = {
 # In der .env Datei kannst du FILE_SERVER_URL=https://dein-server.de/files/ setzen
 FILE_SERVER_BASE_URL = os.getenv("FILE_SERVER_URL", "http://localhost:8000/files/")
 
-def get_connection():
-    return psycopg2.connect(
-        dbname=os.getenv("POSTGRES_DB"),
-        user=os.getenv("POSTGRES_USER"),
-        password=os.getenv("POSTGRES_PASSWORD"),
-        host=os.getenv("POSTGRES_HOST"),
-        port=os.getenv("POSTGRES_PORT")
-    )
-
 # KI-Modelle
 # OPENAI 
 #embeddings_model = OpenAIEmbeddings(model="text-embedding-3-small")
 #llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
 
 # OLLAMA LOKAL 
-embeddings_model = OllamaEmbeddings(model="mxbai-embed-large", base_url="http://ollama:11434") # "ollama" ist der Name des Containers im Netzwerk
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://ollama:11434") # "ollama" ist der Name des Containers im Netzwerk
+embeddings_model = OllamaEmbeddings(model="mxbai-embed-large", base_url=OLLAMA_BASE_URL)
 
-llm = ChatOllama(model="qwen2.5:32b",base_url="http://ollama:11434", temperature=0,num_ctx=16384)
+llm = ChatOllama(model="qwen2.5:32b",base_url=OLLAMA_BASE_URL, temperature=0,num_ctx=16384)
 
 # Hilfsfunktion für globale Konsistenz (Gedächtnis für Entitäts-Typen)
 def get_existing_types(cur):
@@ -49,7 +52,7 @@ def get_existing_types(cur):
         return []
 
 # 2. UNIVERSAL GRAPH EXTRACTION
-def extract_graph_triples(text, existing_types=[]):
+def extract_graph_triples(text, existing_types=[], timings=None):
     type_hint = f"Bisher bekannte Typen: {', '.join(existing_types)}" if existing_types else ""
     
     prompt = f"""
@@ -71,25 +74,39 @@ def extract_graph_triples(text, existing_types=[]):
     
     Text: {text}
     """ 
+    # Nicht erreichbares LLM: nur diese Stufe wiederholen, danach StageError (Job bleibt fortsetzbar)
+    response = with_retry("extract", llm.invoke, prompt)
+    record_llm_usage("extract", response, timings)
     try:
-        response = llm.invoke(prompt)
         clean_content = response.content.replace("```json", "").replace("```", "").strip()
         data = json.loads(clean_content)
         return data.get("triples", [])
     except Exception as e:
+        # Unbrauchbares JSON ist kein Infrastrukturfehler: Chunk ohne Fakten weiterverarbeiten
         print(f"   ! Fehler bei Extraktion: {e}")
         return []
 
-def save_to_graph(cur, triples, doc_id):
-    """Speichert nur qualitativ hochwertige Knoten und Kanten in den Graphen."""
+def parse_confidence(value):
+    """Confidence aus der LLM-Antwort als Zahl 1-5; fehlt sie, gilt 5. Unlesbare Werte ("hoch") -> None."""
+    if value is None:
+        return 5
+    try:
+        return max(1, min(5, int(float(value))))
+    except (TypeError, ValueError):
+        return None
+
+def save_to_graph(writer, triples, doc_id):
+    """Übergibt nur qualitativ hochwertige Knoten und Kanten an den BulkWriter."""
     for t in triples:
         # 1. PRÜFUNG: Vollständigkeit und Confidence
-        # Wir erwarten jetzt auch ein Feld 'confidence' vom LLM
-        if not all(k in t for k in ['s', 'p', 'o']):
+        # Wir erwarten jetzt auch ein Feld 'confidence' vom LLM. Fehlerhafte Tripel werden
+        # übersprungen, sonst scheitert das ganze Dokument bei jedem Versuch am selben Tripel
+        if not isinstance(t, dict) or any(t.get(k) is None for k in ['s', 'p', 'o']):
             continue
         
         # Filter: Nur Fakten mit hoher Sicherheit (falls vom LLM geliefert, sonst Default 5)
-        if int(t.get('confidence', 5)) < 4:
+        confidence = parse_confidence(t.get('confidence'))
+        if confidence is None or confidence < 4:
             continue
 
         # 2. QUALITÄTS-FILTER: Längenbeschränkung
@@ -111,8 +128,8 @@ def save_to_graph(cur, triples, doc_id):
         relation = p_val.lower()
         
         entities = [
-            (s_val, t.get('s_type', 'UNKNOWN').upper()), 
-            (o_val, t.get('o_type', 'UNKNOWN').upper())
+            (s_val, str(t.get('s_type') or 'UNKNOWN').upper()), 
+            (o_val, str(t.get('o_type') or 'UNKNOWN').upper())
         ]
         
         node_ids = []
@@ -121,107 +138,461 @@ def save_to_graph(cur, triples, doc_id):
             clean_name = name.strip()
             e_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, clean_name.lower()))
             node_ids.append(e_id)
-            
-            cur.execute("""
-                INSERT INTO document_nodes (id, entity_name, entity_type) 
-                VALUES (%s, %s, %s) 
-                ON CONFLICT (id) DO UPDATE SET 
-                    entity_type = EXCLUDED.entity_type 
-                WHERE EXCLUDED.entity_type != 'UNKNOWN'
-            """, (e_id, clean_name, e_type))
+            writer.add_node(e_id, clean_name, e_type)
         
-        # 4. KANTE SPEICHERN
-        cur.execute("""
-            INSERT INTO document_edges (id, source_node_id, target_node_id, relation_type, source_doc_id, confidence)
-            VALUES (%s, %s, %s, %s, %s, %s) 
-            ON CONFLICT DO NOTHING
-        """, (str(uuid.uuid4()), node_ids[0], node_ids[1], relation, doc_id, int(t.get('confidence', 5))))
+        # 4. KANTE VORMERKEN (geschrieben wird gesammelt in BulkWriter.flush)
+        writer.add_edge(uuid.uuid4(), node_ids[0], node_ids[1], relation, doc_id, confidence)
 
 # 3. VERARBEITUNGSLOGIK
+# Große Chunks (Parent) für Kontext, kleine (Child) für präzise Vektorsuche
+parent_splitter = RecursiveCharacterTextSplitter(chunk_size=1750, chunk_overlap=250)
+child_splitter = RecursiveCharacterTextSplitter(chunk_size=300, chunk_overlap=50)
+
+# Docling-Converter einmal pro Prozess aufbauen (lädt Layout-/OCR-Modelle) und wiederverwenden
+_converter = None
+
+def get_converter():
+    global _converter
+    if _converter is None:
+        _converter = DocumentConverter()
+    return _converter
+
+def convert_document(file_path):
+    # A. Konvertierung mit Docling (behält Tabellenstrukturen bei)
+    result = get_converter().convert(file_path)
+    return result.document.export_to_markdown()
+
+def embed_parent(p_text):
+    # Vektor-Embeddings der Child-Chunks eines Parents (Ähnlichkeitssuche)
+    child_chunks = child_splitter.split_text(p_text)
+    vectors = embeddings_model.embed_documents(child_chunks) if child_chunks else []
+    return child_chunks, vectors
+
+# C. INKREMENTELLES RE-INDEXING
+# Datei- und Chunk-Hashes liegen in parent_documents.metadata. Unveränderte Dateien
+# werden übersprungen; bei geänderten Dateien werden nur neue/geänderte
+# Parent-Chunks extrahiert und eingebettet, entfallene samt Kanten gelöscht.
+def file_hash(file_path):
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def chunk_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def file_fingerprint(file_path):
+    stat = os.stat(file_path)
+    return {"file_size": stat.st_size, "file_mtime": int(stat.st_mtime)}
+
+class PendingDocument:
+    """Änderungsplan für eine Datei: neue Parents, behaltene Parents und zu löschende Parents."""
+
+    def __init__(self, file_path, fingerprint, parents, kept, removed):
+        self.file_path = file_path
+        self.filename = os.path.basename(file_path)
+        self.fingerprint = fingerprint
+        self.parents = parents     # nur neue/geänderte Chunks (werden verarbeitet)
+        self.kept = kept           # [(parent_id, metadata)] unverändert, nur Metadaten aktualisieren
+        self.removed = removed     # [parent_id] entfallen, werden gelöscht (Chunks & Kanten per CASCADE)
+        self.remaining = len(parents)
+        self.failed = False
+        self.lock = threading.Lock()
+        self.timings = Timings()   # Summe über alle Parents, auch wenn sie parallel laufen
+
+    def finish_parent(self):
+        with self.lock:
+            self.remaining -= 1
+            return self.remaining == 0
+
+def plan_document(cur, file_path, fingerprint, parent_chunks):
+    filename = os.path.basename(file_path)
+    # Bestehende Chunk-Hashes laden; ältere Zeilen ohne Hash werden aus dem Text berechnet
+    cur.execute("""
+        SELECT id, COALESCE(metadata->>'chunk_hash', encode(sha256(convert_to(full_text, 'UTF8')), 'hex'))
+        FROM parent_documents
+        WHERE title = %s
+    """, (filename,))
+    existing = {}
+    for p_id, h in cur.fetchall():
+        existing.setdefault(h, []).append(p_id)
+
+    parents, kept = [], []
+    for idx, p_text in enumerate(parent_chunks):
+        h = chunk_hash(p_text)
+        metadata = {**fingerprint, "chunk_hash": h, "chunk_index": idx}
+        if existing.get(h):
+            kept.append((existing[h].pop(), metadata))
+        else:
+            parents.append({"text": p_text, "metadata": metadata, "triples": [], "chunks": [], "vectors": []})
+    removed = [p_id for ids in existing.values() for p_id in ids]
+    return PendingDocument(file_path, fingerprint, parents, kept, removed)
+
+def write_parent(doc, parent):
+    """
+    Checkpoint: schreibt einen fertig verarbeiteten Parent-Chunk (inkl. Child-Chunks und
+    Kanten) in einer eigenen Transaktion per binärem COPY. Nach einem Absturz erkennt
+    plan_document ihn am chunk_hash wieder und verarbeitet ihn nicht erneut.
+    """
+    # Web-URL für den Zugriff generieren (Server-ready)
+    # Beispiel: http://localhost:8000/files/Zeugnis.pdf
+    web_url = f"{FILE_SERVER_BASE_URL}{doc.filename}"
+
+    writer = BulkWriter()
+    p_id = uuid.uuid4()
+    # Parent inklusive der URL für klickbare Links in WebUI
+    writer.add_parent(p_id, doc.filename, parent["text"], web_url, parent["metadata"])
+    save_to_graph(writer, parent["triples"], p_id)
+    for c_text, vec in zip(parent["chunks"], parent["vectors"]):
+        writer.add_chunk(uuid.uuid4(), p_id, c_text, vec)
+    with get_pool().connection() as conn, conn.cursor() as cur:
+        writer.flush(cur)
+
+def finalize_document(doc):
+    """Entfallene Parents löschen, Metadaten der behaltenen aktualisieren, Job abschließen."""
+    with get_pool().connection() as conn, conn.cursor() as cur:
+        if doc.removed:
+            cur.execute("DELETE FROM parent_documents WHERE id = ANY(%s)", (doc.removed,))
+        if doc.kept:
+            cur.executemany(
+                "UPDATE parent_documents SET metadata = %s WHERE id = %s",
+                [(Jsonb(metadata), p_id) for p_id, metadata in doc.kept]
+            )
+        finish_job(cur, doc.file_path)
+        # Backend-Caches über das neue Dokument informieren (wird mit dem COMMIT zugestellt);
+        # sind Parents entfallen, können Namen verschwunden sein: dann kompletter Neuaufbau
+        notify_corpus_changed(cur, None if doc.removed else doc.filename)
+
+def prune_orphan_nodes(cur):
+    # Knoten ohne Kanten entfernen (nach gelöschten Chunks). Läuft erst am Ende des
+    # Laufs, damit kein paralleler Writer einen gerade wiederverwendeten Knoten verliert.
+    cur.execute("""
+        DELETE FROM document_nodes n
+        WHERE NOT EXISTS (SELECT 1 FROM document_edges e WHERE e.source_node_id = n.id)
+          AND NOT EXISTS (SELECT 1 FROM document_edges e WHERE e.target_node_id = n.id)
+    """)
+    return cur.rowcount
+
+def prepare_document(file_path, fingerprint):
+    """Job starten, Markdown aus dem Checkpoint oder per Docling holen und den Änderungsplan erstellen."""
+    markdown_text = start_job(file_path, fingerprint["file_hash"])
+    if markdown_text is None:
+        markdown_text = with_retry("convert", convert_document, file_path)
+        save_checkpoint(file_path, "extract", markdown=markdown_text)
+    else:
+        print("   ↪ Docling-Ergebnis aus Checkpoint übernommen")
+    return split_and_plan(file_path, fingerprint, markdown_text)
+
+def split_and_plan(file_path, fingerprint, markdown_text):
+    # B. Chunking
+    parent_chunks = parent_splitter.split_text(markdown_text)
+    with get_pool().connection() as conn, conn.cursor() as cur:
+        return plan_document(cur, file_path, fingerprint, parent_chunks)
+
 def ingest_document(file_path):
     ext = os.path.splitext(file_path)[1].lower()
     if ext not in SUPPORTED_EXTENSIONS: return
 
     filename = os.path.basename(file_path)
     print(f"\n🚀 Verarbeite Dokument: {filename}")
+    timings = Timings()
     
     try:
-        # A. Konvertierung mit Docling (behält Tabellenstrukturen bei)
-        converter = DocumentConverter()
-        result = converter.convert(file_path)
-        markdown_text = result.document.export_to_markdown()
-        
-        # B. Chunking
-        # Große Chunks (Parent) für Kontext, kleine (Child) für präzise Vektorsuche
-        parent_splitter = RecursiveCharacterTextSplitter(chunk_size=1750, chunk_overlap=250)
-        child_splitter = RecursiveCharacterTextSplitter(chunk_size=300, chunk_overlap=50)
-        
-        conn = get_connection()
-        cur = conn.cursor()
-        
+        fingerprint = {**file_fingerprint(file_path), "file_hash": file_hash(file_path)}
+        with span("ingestion", "prepare", timings):
+            doc = prepare_document(file_path, fingerprint)
+        print(f"   {len(doc.parents)} neu, {len(doc.kept)} unverändert, {len(doc.removed)} entfernt")
+
         # Bekannte Typen für Prompt-Konsistenz laden
-        known_types = get_existing_types(cur)
+        with get_pool().connection() as conn, conn.cursor() as cur:
+            known_types = get_existing_types(cur)
 
-        parent_chunks = parent_splitter.split_text(markdown_text)
-        
-        # Web-URL für den Zugriff generieren (Server-ready)
-        # Beispiel: http://localhost:8000/files/Zeugnis.pdf
-        web_url = f"{FILE_SERVER_BASE_URL}{filename}"
-        
-        for idx, p_text in enumerate(parent_chunks):
-            p_id = str(uuid.uuid4())
-            
-            # 1. Parent speichern (Inklusive der URL für klickbare Links in WebUI)
-            cur.execute("""
-                INSERT INTO parent_documents (id, title, full_text, source_url) 
-                VALUES (%s, %s, %s, %s)
-            """, (p_id, filename, p_text, web_url))
-            
-            # 2. Graph-Fakten extrahieren (On-the-fly Schema Lernen)
-            print(f"   [Chunk {idx+1}/{len(parent_chunks)}] Extrahiere Fakten...")
-            triples = extract_graph_triples(p_text, existing_types=known_types)
-            save_to_graph(cur, triples, p_id)
-            
-            # 3. Vektor-Speicherung (Embeddings für Ähnlichkeitssuche)
-            child_chunks = child_splitter.split_text(p_text)
-            if child_chunks:
-                vectors = embeddings_model.embed_documents(child_chunks)
-                for c_text, vec in zip(child_chunks, vectors):
-                    cur.execute("""
-                        INSERT INTO document_chunks (id, parent_id, content, embedding) 
-                        VALUES (%s, %s, %s, %s)
-                    """, (str(uuid.uuid4()), p_id, c_text, vec))
-        
-        conn.commit()
-        cur.close()
-        conn.close()
+        for idx, parent in enumerate(doc.parents):
+            # Graph-Fakten extrahieren (On-the-fly Schema Lernen)
+            print(f"   [Chunk {idx+1}/{len(doc.parents)}] Extrahiere Fakten...")
+            with span("ingestion", "extract", timings):
+                parent["triples"] = extract_graph_triples(parent["text"], existing_types=known_types, timings=timings)
+            with span("ingestion", "embed", timings):
+                parent["chunks"], parent["vectors"] = with_retry("embed", embed_parent, parent["text"])
+            with span("ingestion", "write", timings):
+                with_retry("write", write_parent, doc, parent)
+
+        with span("ingestion", "finalize", timings):
+            with_retry("finalize", finalize_document, doc)
         print(f"✅ Fertig: {filename}")
-        
+        print(f"   ⏱️ {timings.summary()} | Tokens: {timings.tokens}")
+
+    except StageError as e:
+        print(f"❌ Stufe '{e.stage}' fehlgeschlagen bei {file_path}: {e.error} (fortsetzbar mit --resume)")
+        fail_job(file_path, e.stage, e.error)
     except Exception as e:
         print(f"❌ Schwerer Fehler bei {file_path}: {e}")
+        fail_job(file_path, "unknown", e)
+
+# 4. PIPELINE-MODUS (--workers > 1)
+# Docling (CPU) in einem Prozess-Pool, LLM-Extraktion und Embeddings (GPU) in
+# begrenzten Thread-Queues, ein Writer committet jeden fertigen Parent-Chunk.
+# Volle Queues bremsen die vorherigen Stufen (Backpressure), und es sind nie
+# mehr als max_docs Dokumente gleichzeitig im Speicher.
+_STOP = object()
+
+def _convert_worker(file_path):
+    # Läuft im Prozess-Pool; jeder Prozess nutzt seinen eigenen wiederverwendbaren Converter.
+    # Die Dauer wird mitgeliefert, weil Metriken im Kindprozess verloren gingen
+    start = time.perf_counter()
+    markdown_text = with_retry("convert", convert_document, file_path)
+    return markdown_text, time.perf_counter() - start
+
+def run_pipeline(file_paths, workers=2, llm_workers=2, embed_workers=1, queue_size=32, max_docs=None):
+    max_docs = max_docs or workers * 2
+    extract_q = queue.Queue(maxsize=queue_size)
+    embed_q = queue.Queue(maxsize=queue_size)
+    write_q = queue.Queue(maxsize=queue_size)
+    doc_slots = threading.BoundedSemaphore(max_docs)
+
+    with get_pool().connection() as conn, conn.cursor() as cur:
+        known_types = get_existing_types(cur)
+
+    def finish_document(doc):
+        # Läuft im Writer-Thread, sobald alle Parents eines Dokuments durch sind
+        try:
+            if doc.failed:
+                print(f"❌ Stufe '{doc.failed.stage}' fehlgeschlagen bei {doc.filename}: {doc.failed.error} (fortsetzbar mit --resume)")
+                fail_job(doc.file_path, doc.failed.stage, doc.failed.error)
+                return
+            with span("ingestion", "finalize", doc.timings):
+                with_retry("finalize", finalize_document, doc)
+            print(f"✅ Fertig: {doc.filename} ({len(doc.parents)} neu, {len(doc.kept)} unverändert, {len(doc.removed)} entfernt)")
+            print(f"   ⏱️ {doc.timings.summary()} | Tokens: {doc.timings.tokens}")
+        except Exception as e:
+            print(f"❌ Schwerer Fehler beim Abschluss von {doc.filename}: {e}")
+            fail_job(doc.file_path, "finalize", e)
+        finally:
+            doc_slots.release()
+
+    def parent_failed(doc, error):
+        doc.failed = error
+        if doc.finish_parent():
+            write_q.put(("finalize", doc, None))
+
+    def extract_loop():
+        while (item := extract_q.get()) is not _STOP:
+            doc, idx = item
+            try:
+                with span("ingestion", "extract", doc.timings):
+                    doc.parents[idx]["triples"] = extract_graph_triples(doc.parents[idx]["text"], existing_types=known_types, timings=doc.timings)
+            except StageError as e:
+                parent_failed(doc, e)
+                continue
+            embed_q.put(item)
+
+    def embed_loop():
+        while (item := embed_q.get()) is not _STOP:
+            doc, idx = item
+            try:
+                with span("ingestion", "embed", doc.timings):
+                    doc.parents[idx]["chunks"], doc.parents[idx]["vectors"] = with_retry("embed", embed_parent, doc.parents[idx]["text"])
+            except StageError as e:
+                parent_failed(doc, e)
+                continue
+            write_q.put(("parent", doc, idx))
+
+    def write_loop():
+        while (item := write_q.get()) is not _STOP:
+            kind, doc, idx = item
+            if kind == "parent":
+                try:
+                    with span("ingestion", "write", doc.timings):
+                        with_retry("write", write_parent, doc, doc.parents[idx])
+                except StageError as e:
+                    doc.failed = e
+                if not doc.finish_parent():
+                    continue
+            finish_document(doc)
+
+    extractors = [threading.Thread(target=extract_loop, name=f"extract-{i}") for i in range(llm_workers)]
+    embedders = [threading.Thread(target=embed_loop, name=f"embed-{i}") for i in range(embed_workers)]
+    writer = threading.Thread(target=write_loop, name="writer")
+    for t in extractors + embedders + [writer]:
+        t.start()
+
+    # Spawn statt Fork: sauberer Start neben den laufenden Threads
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as convert_pool:
+        submitted = queue.Queue()
+
+        def submit_loop():
+            for path in file_paths:
+                # Neues Dokument erst annehmen, wenn ein Platz frei ist (begrenzt den Speicher)
+                doc_slots.acquire()
+                print(f"\n🚀 Verarbeite Dokument: {os.path.basename(path)}")
+                try:
+                    fingerprint = {**file_fingerprint(path), "file_hash": file_hash(path)}
+                    markdown_text = start_job(path, fingerprint["file_hash"])
+                except Exception as e:
+                    print(f"❌ Schwerer Fehler bei {path}: {e}")
+                    doc_slots.release()
+                    continue
+                if markdown_text is not None:
+                    # Checkpoint vorhanden: Docling überspringen
+                    future = Future()
+                    future.set_result((markdown_text, 0.0))
+                else:
+                    future = convert_pool.submit(_convert_worker, path)
+                submitted.put((future, path, fingerprint, markdown_text is None))
+            submitted.put(_STOP)
+
+        feeder = threading.Thread(target=submit_loop, name="feeder")
+        feeder.start()
+        # Konvertierte Dokumente in Chunks zerlegen und in die Extraktion geben
+        while (item := submitted.get()) is not _STOP:
+            _enqueue_converted(*item, extract_q, write_q, doc_slots)
+        feeder.join()
+
+    # Stufen nacheinander herunterfahren
+    for _ in extractors:
+        extract_q.put(_STOP)
+    for t in extractors:
+        t.join()
+    for _ in embedders:
+        embed_q.put(_STOP)
+    for t in embedders:
+        t.join()
+    write_q.put(_STOP)
+    writer.join()
+
+def _enqueue_converted(future, path, fingerprint, is_fresh, extract_q, write_q, doc_slots):
+    try:
+        markdown_text, convert_seconds = future.result()
+        if is_fresh:
+            save_checkpoint(path, "extract", markdown=markdown_text)
+        doc = split_and_plan(path, fingerprint, markdown_text)
+        if is_fresh:
+            observe("ingestion", "convert", convert_seconds, doc.timings)
+    except StageError as e:
+        print(f"❌ Stufe '{e.stage}' fehlgeschlagen bei {path}: {e.error} (fortsetzbar mit --resume)")
+        fail_job(path, e.stage, e.error)
+        doc_slots.release()
+        return
+    except Exception as e:
+        print(f"❌ Schwerer Fehler bei {path}: {e}")
+        fail_job(path, "convert", e)
+        doc_slots.release()
+        return
+    if not doc.parents:
+        # Nichts zu extrahieren: nur Löschungen/Metadaten, direkt zum Abschluss
+        write_q.put(("finalize", doc, None))
+        return
+    for idx in range(len(doc.parents)):
+        extract_q.put((doc, idx))
+
+# 5. STARTPUNKT (Inkrementelles Update)
+def load_index_state():
+    """Pro Titel: gespeicherte Datei-Fingerprints (Größe, mtime, Hash) aller Parents."""
+    with get_pool().connection() as conn:
+        cur = conn.execute("""
+            SELECT title,
+                   array_agg(DISTINCT metadata->>'file_hash'),
+                   array_agg(DISTINCT metadata->>'file_size'),
+                   array_agg(DISTINCT metadata->>'file_mtime')
+            FROM parent_documents
+            GROUP BY title
+        """)
+        return {row[0]: row[1:] for row in cur.fetchall()}
+
+def is_unchanged(file_path, state):
+    """Schneller Check über Größe/mtime, erst bei Abweichung wird der Inhalt gehasht."""
+    if state is None:
+        return False
+    hashes, sizes, mtimes = state
+    if len(hashes) != 1 or hashes[0] is None:
+        return False  # Altbestand ohne Hash oder unvollständig aktualisiert
+    fp = file_fingerprint(file_path)
+    if sizes == [str(fp["file_size"])] and mtimes == [str(fp["file_mtime"])]:
+        return True
+    if file_hash(file_path) != hashes[0]:
+        return False
+    # Inhalt gleich, nur Zeitstempel neu: Fingerprint nachziehen, damit der nächste Lauf nicht erneut hasht
+    with get_pool().connection() as conn:
+        conn.execute(
+            "UPDATE parent_documents SET metadata = metadata || %s WHERE title = %s",
+            (Jsonb(fp), os.path.basename(file_path))
+        )
+    return True
 
-# 4. STARTPUNKT (Inkrementelles Update)
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dokumente aus DOC_DIR in die Hybrid-Datenbank einlesen")
+    parser.add_argument("--workers", type=int, default=1, help="Docling-Prozesse; > 1 aktiviert den Pipeline-Modus")
+    parser.add_argument("--llm-workers", type=int, default=2, help="Parallele LLM-Extraktionen (Pipeline-Modus)")
+    parser.add_argument("--embed-workers", type=int, default=1, help="Parallele Embedding-Aufrufe (Pipeline-Modus)")
+    parser.add_argument("--queue-size", type=int, default=32, help="Maximale Parent-Chunks pro Queue (Backpressure)")
+    parser.add_argument("--prune", action="store_true", help="Dokumente löschen, deren Datei nicht mehr in DOC_DIR liegt")
+    parser.add_argument("--resume", action="store_true", help="Nur abgebrochene/fehlgeschlagene Jobs fortsetzen")
+    args = parser.parse_args()
+
     doc_dir = os.getenv("DOC_DIR")
     if not doc_dir or not os.path.exists(doc_dir):
         print("Fehler: DOC_DIR nicht konfiguriert.")
     else:
         try:
-            conn = get_connection()
-            cur = conn.cursor()
-            # Nur Dateien laden, die noch nicht in der Datenbank existieren
-            cur.execute("SELECT DISTINCT title FROM parent_documents")
-            indexed_files = {row[0] for row in cur.fetchall()}
-            cur.close()
-            conn.close()
-            print(f"Status: {len(indexed_files)} Dokumente bereits indexiert.")
-        except:
-            indexed_files = set()
+            index_state = load_index_state()
+            print(f"Status: {len(index_state)} Dokumente bereits indexiert.")
+        except Exception as e:
+            print(f"⚠️ Index-Status nicht lesbar ({e}), verarbeite alle Dateien.")
+            index_state = {}
+
+        try:
+            unfinished = load_unfinished_jobs()
+        except Exception as e:
+            print(f"⚠️ Job-Tabelle nicht lesbar ({e}), ohne Wiederaufnahme.")
+            unfinished = {}
+        for path, (status, stage, attempts, last_error) in unfinished.items():
+            print(f"↩️ Offener Job: {os.path.basename(path)} ({status}, Stufe {stage}, {attempts} Versuch(e)) {last_error or ''}")
 
         files = [f for f in os.listdir(doc_dir) if os.path.splitext(f)[1].lower() in SUPPORTED_EXTENSIONS]
         
-        for filename in files:
-            if filename in indexed_files:
-                print(f"⏩ Überspringe: {filename} (Bereits vorhanden)")
-                continue
-            ingest_document(os.path.join(doc_dir, filename))
+        pending = []
+        if args.resume:
+            pending = [path for path in unfinished if os.path.exists(path)]
+        else:
+            for filename in files:
+                path = os.path.join(doc_dir, filename)
+                # Abgebrochene Jobs nie überspringen, auch wenn schon einzelne Parents geschrieben sind
+                if path not in unfinished and is_unchanged(path, index_state.get(filename)):
+                    print(f"⏩ Überspringe: {filename} (Unverändert)")
+                    continue
+                pending.append(path)
+
+        if args.workers > 1:
+            run_pipeline(
+                pending,
+                workers=args.workers,
+                llm_workers=args.llm_workers,
+                embed_workers=args.embed_workers,
+                queue_size=args.queue_size,
+            )
+        else:
+            for path in pending:
+                ingest_document(path)
+
+        with get_pool().connection() as conn, conn.cursor() as cur:
+            if args.prune:
+                gone = [t for t in index_state if t not in set(files)]
+                for title in gone:
+                    cur.execute("DELETE FROM parent_documents WHERE title = %s", (title,))
+                    notify_corpus_changed(cur)
+                    print(f"🗑️ Entfernt: {title} (Datei nicht mehr vorhanden)")
+            removed_nodes = prune_orphan_nodes(cur)
+            if removed_nodes:
+                print(f"🧹 {removed_nodes} verwaiste Graph-Knoten entfernt")
+
+        close_pool()
+
+        # Stufen-Histogramme des Laufs für Prometheus (PUSHGATEWAY_URL / METRICS_TEXTFILE)
+        try:
+            targets = export_batch_metrics("rag_ingestion")
+            if targets:
+                print(f"📊 Metriken exportiert: {', '.join(targets)}")
+        except Exception as e:
+            print(f"⚠️ Metriken nicht exportiert: {e}")
@@ -0,0 +1,108 @@
+import time
+import httpx
+import openai
+import psycopg
+import requests
+from db import get_pool
+
+# Persistente Ingestion-Jobs (Tabelle ingestion_jobs, siehe VektorErweiterung.sql).
+# Pro Datei ein Job mit Status, aktueller Stufe und dem Docling-Ergebnis als
+# Checkpoint. Parent-Chunks werden einzeln committet; bei einem Neustart erkennt
+# plan_document sie über ihren chunk_hash wieder, sodass nur der Rest läuft.
+
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 2.0  # Sekunden, verdoppelt sich pro Versuch
+
+# Nur Verbindungs- und Zeitüberschreitungsfehler wiederholen; ein Datenfehler
+# tritt beim nächsten Versuch genauso auf und scheitert sofort
+TRANSIENT_ERRORS = (
+    psycopg.OperationalError,
+    httpx.TransportError,
+    requests.ConnectionError,
+    requests.Timeout,
+    openai.APIConnectionError,
+    ConnectionError,
+    TimeoutError,
+)
+
+class StageError(Exception):
+    """Eine Stufe ist auch nach allen Wiederholungen fehlgeschlagen."""
+
+    def __init__(self, stage, error):
+        # args = (stage, error), damit die Ausnahme aus dem Docling-Prozess-Pool zurückgepickelt werden kann
+        super().__init__(stage, error)
+        self.stage = stage
+        self.error = error
+
+    def __str__(self):
+        return f"{self.stage}: {self.error}"
+
+def with_retry(stage, fn, *args, attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY, **kwargs):
+    """Führt nur die übergebene Stufe bei vorübergehenden Fehlern erneut aus (exponentielles Backoff)."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == attempts or not isinstance(e, TRANSIENT_ERRORS):
+                raise StageError(stage, e) from e
+            delay = base_delay * 2 ** (attempt - 1)
+            print(f"   ! {stage} fehlgeschlagen (Versuch {attempt}/{attempts}): {e} – neuer Versuch in {delay:.0f}s")
+            time.sleep(delay)
+
+def start_job(file_path, file_hash):
+    """
+    Legt den Job an oder übernimmt einen bestehenden. Gehört der gespeicherte
+    Checkpoint zu einem anderen Dateistand, wird er verworfen.
+    Gibt das gespeicherte Markdown zurück (oder None).
+    """
+    with get_pool().connection() as conn:
+        row = conn.execute("""
+            INSERT INTO ingestion_jobs (file_path, file_hash, status, stage, attempts)
+            VALUES (%s, %s, 'running', 'convert', 1)
+            ON CONFLICT (file_path) DO UPDATE SET
+                status = 'running',
+                attempts = CASE WHEN ingestion_jobs.file_hash = EXCLUDED.file_hash
+                                THEN ingestion_jobs.attempts + 1 ELSE 1 END,
+                markdown = CASE WHEN ingestion_jobs.file_hash = EXCLUDED.file_hash
+                                THEN ingestion_jobs.markdown END,
+                file_hash = EXCLUDED.file_hash,
+                last_error = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING markdown
+        """, (file_path, file_hash)).fetchone()
+    return row[0]
+
+def save_checkpoint(file_path, stage, markdown=None):
+    with get_pool().connection() as conn:
+        conn.execute("""
+            UPDATE ingestion_jobs
+            SET stage = %s, markdown = COALESCE(%s, markdown), updated_at = CURRENT_TIMESTAMP
+            WHERE file_path = %s
+        """, (stage, markdown, file_path))
+
+def finish_job(cur, file_path):
+    # Läuft in der Abschluss-Transaktion des Dokuments; Markdown wird nicht mehr gebraucht
+    cur.execute("""
+        UPDATE ingestion_jobs
+        SET status = 'done', stage = NULL, markdown = NULL, last_error = NULL, updated_at = CURRENT_TIMESTAMP
+        WHERE file_path = %s
+    """, (file_path,))
+
+def fail_job(file_path, stage, error):
+    with get_pool().connection() as conn:
+        conn.execute("""
+            UPDATE ingestion_jobs
+            SET status = 'failed', stage = %s, last_error = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE file_path = %s
+        """, (stage, str(error)[:2000], file_path))
+
+def load_unfinished_jobs():
+    """Alle Jobs, die nicht abgeschlossen sind (abgestürzt, fehlgeschlagen oder offen)."""
+    with get_pool().connection() as conn:
+        cur = conn.execute("""
+            SELECT file_path, status, stage, attempts, last_error
+            FROM ingestion_jobs
+            WHERE status <> 'done'
+            ORDER BY updated_at
+        """)
+        return {row[0]: row[1:] for row in cur.fetchall()}
@@ -0,0 +1,146 @@
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST, push_to_gateway, write_to_textfile
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+# Laufzeitmessung pro Stufe für API, Engine und Ingestion.
+# Jede Stufe landet als Prometheus-Histogramm (/metrics) und, falls für die
+# laufende Anfrage aktiviert, zusätzlich in einem Timings-Objekt für die Antwort.
+# Die Ingestion läuft als Kommandozeilen-Prozess ohne /metrics und exportiert ihre
+# Histogramme am Ende des Laufs (Pushgateway und/oder Textfile für den node_exporter).
+
+PUSHGATEWAY_URL = os.getenv("PUSHGATEWAY_URL")    # z.B. http://pushgateway:9091
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE")  # z.B. /var/lib/node_exporter/textfile/rag_ingestion.prom
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Dauer einzelner Verarbeitungsstufen",
+    ["component", "stage"],
+    buckets=STAGE_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total",
+    "Vom LLM verarbeitete Tokens",
+    ["call", "kind"],
+)
+CONTEXT_TOKENS = Histogram(
+    "rag_context_tokens",
+    "Geschätzte Tokens von Kontext und Graph im Prompt",
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+RERANK_BATCH_PAIRS = Histogram(
+    "rag_rerank_batch_pairs",
+    "(Frage, Chunk)-Paare pro Forward-Pass des Rerankers",
+    buckets=(1, 8, 16, 32, 64, 128, 256),
+)
+
+_current = contextvars.ContextVar("rag_timings", default=None)
+
+class Timings:
+    """Sammelt Stufen-Dauern und Token-Zahlen einer Anfrage bzw. eines Dokuments."""
+
+    def __init__(self):
+        self.stages = {}
+        self.tokens = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = round(self.stages.get(stage, 0.0) + seconds, 4)
+
+    def add_tokens(self, kind, count):
+        with self._lock:
+            self.tokens[kind] = self.tokens.get(kind, 0) + count
+
+    def as_dict(self):
+        return {"stages": dict(self.stages), "tokens": dict(self.tokens)}
+
+    def summary(self):
+        return " | ".join(f"{stage} {seconds:.2f}s" for stage, seconds in self.stages.items())
+
+def start_timings():
+    """Timings für den aktuellen Kontext anlegen; asyncio-Tasks erben ihn beim Erzeugen."""
+    timings = Timings()
+    _current.set(timings)
+    return timings
+
+def observe(component, stage, seconds, timings=None):
+    STAGE_SECONDS.labels(component, stage).observe(seconds)
+    target = timings if timings is not None else _current.get()
+    if target is not None:
+        target.add_stage(stage, seconds)
+
+@contextmanager
+def span(component, stage, timings=None):
+    """Misst die Dauer des Blocks (auch über await hinweg) und verbucht sie."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(component, stage, time.perf_counter() - start, timings)
+
+def record_llm_usage(call, message, timings=None):
+    """Token-Zahlen aus einer LLM-Antwort (usage_metadata bzw. Ollama-Metadaten) verbuchen."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    meta = getattr(message, "response_metadata", None) or {}
+    counts = {
+        "prompt": usage.get("input_tokens") or meta.get("prompt_eval_count"),
+        "completion": usage.get("output_tokens") or meta.get("eval_count"),
+    }
+    timings = timings if timings is not None else _current.get()
+    for kind, count in counts.items():
+        if count:
+            LLM_TOKENS.labels(call, kind).inc(count)
+            if timings is not None:
+                timings.add_tokens(f"{call}_{kind}", count)
+
+def record_context_tokens(count):
+    CONTEXT_TOKENS.observe(count)
+    timings = _current.get()
+    if timings is not None:
+        timings.add_tokens("context", count)
+
+class CacheCollector:
+    """Stellt Cache-Statistiken (Treffer, Fehlzugriffe, Trefferquote, Größe) beim Scrape bereit."""
+
+    def __init__(self, stats_fn):
+        self.stats_fn = stats_fn
+
+    def collect(self):
+        hits = CounterMetricFamily("rag_cache_hits", "Cache-Treffer", labels=["cache"])
+        misses = CounterMetricFamily("rag_cache_misses", "Cache-Fehlzugriffe", labels=["cache"])
+        ratio = GaugeMetricFamily("rag_cache_hit_ratio", "Trefferquote seit Start", labels=["cache"])
+        entries = GaugeMetricFamily("rag_cache_entries", "Einträge im Cache", labels=["cache"])
+        size = GaugeMetricFamily("rag_cache_bytes", "Geschätzte Größe in Bytes", labels=["cache"])
+        for name, stats in self.stats_fn().items():
+            if "hit_rate" not in stats:
+                continue
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            ratio.add_metric([name], stats["hit_rate"])
+            entries.add_metric([name], stats["entries"])
+            size.add_metric([name], stats["bytes"])
+        yield from (hits, misses, ratio, entries, size)
+
+def register_cache_stats(stats_fn):
+    REGISTRY.register(CacheCollector(stats_fn))
+
+def render_metrics():
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+def export_batch_metrics(job):
+    """Metriken eines Kommandozeilen-Laufs exportieren; gibt die Ziele zurück (leer = nicht konfiguriert)."""
+    targets = []
+    if PUSHGATEWAY_URL:
+        push_to_gateway(PUSHGATEWAY_URL, job=job, registry=REGISTRY)
+        targets.append(PUSHGATEWAY_URL)
+    if METRICS_TEXTFILE:
+        # Schreibt atomar (temporäre Datei + rename), der node_exporter liest nie eine halbe Datei
+        write_to_textfile(METRICS_TEXTFILE, REGISTRY)
+        targets.append(METRICS_TEXTFILE)
+    return targets
@@ -0,0 +1,328 @@
+import os
+import json
+import struct
+import asyncio
+import logging
+import threading
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from cache import TTLCache, normalize_key
+from metrics import RERANK_BATCH_PAIRS
+
+# Reranker-Dienst im Backend: dedupliziert Kandidaten, merkt sich Scores pro
+# (Frage, Chunk) und bündelt gleichzeitige Anfragen zu gemeinsamen Forward-Passes
+# des Cross-Encoders (Micro-Batching), statt jede Frage einzeln zu bewerten.
+# Das Modell wird erst beim Warm-up bzw. beim ersten Forward-Pass geladen.
+# Im Multi-Worker-Betrieb läuft der Cross-Encoder nur einmal als eigener Prozess
+# (python reranker.py); die API-Worker schicken ihre Paare über RERANK_SOCKET dorthin.
+
+logger = logging.getLogger("rag.reranker")
+
+# "ms-marco-MultiBERT-L-12" (mehrsprachig, Standard), "ms-marco-MiniLM-L-12-v2" bzw.
+# "ms-marco-TinyBERT-L-2-v2" (kleiner/schneller, aber nur Englisch) oder "none"
+# (kein Cross-Encoder, Reihenfolge der Rank Fusion wird übernommen)
+RERANK_MODEL = os.getenv("RERANK_MODEL", "ms-marco-MultiBERT-L-12")
+RERANK_CACHE_DIR = os.getenv("RERANK_CACHE_DIR", "/app/models/flashrank")
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "512"))
+
+# CPU-Threads: RERANK_WORKERS parallele Forward-Passes mit je RERANK_THREADS
+# ONNX-Threads (0 = ONNX Runtime entscheidet selbst)
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "2"))
+RERANK_THREADS = int(os.getenv("RERANK_THREADS", "0"))
+
+# Micro-Batching: so lange auf weitere Anfragen warten bzw. so viele Paare pro Forward-Pass
+RERANK_BATCH_WINDOW_MS = float(os.getenv("RERANK_BATCH_WINDOW_MS", "5"))
+RERANK_MAX_BATCH = int(os.getenv("RERANK_MAX_BATCH", "64"))
+
+# Früher Abbruch nach Score der ersten Stufe: höchstens so viele Kandidaten bewerten und
+# nur solche mit mindestens RERANK_MIN_FUSION_RATIO x bestem Fusions-Score (0 = aus)
+RERANK_MAX_CANDIDATES = int(os.getenv("RERANK_MAX_CANDIDATES", "40"))
+RERANK_MIN_FUSION_RATIO = float(os.getenv("RERANK_MIN_FUSION_RATIO", "0"))
+
+# Unix-Socket des gemeinsamen Reranker-Prozesses (leer = Modell im eigenen Prozess)
+RERANK_SOCKET = os.getenv("RERANK_SOCKET", "")
+
+RERANK_CACHE_ENTRIES = int(os.getenv("RERANK_CACHE_ENTRIES", "50000"))
+RERANK_CACHE_TTL = float(os.getenv("CACHE_TTL", "3600"))
+
+def _frame(message):
+    # Nachrichten über den Socket: 4 Byte Länge + JSON
+    data = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    return struct.pack("!I", len(data)) + data
+
+async def _read_frame(reader):
+    size = struct.unpack("!I", await reader.readexactly(4))[0]
+    return json.loads(await reader.readexactly(size))
+
+def load_cross_encoder(model_name, cache_dir, threads):
+    """Lädt das FlashRank-Modell und ersetzt die ONNX-Session durch eine mit festen Thread-Zahlen."""
+    import onnxruntime as ort
+    from flashrank import Ranker
+
+    ranker = Ranker(model_name=model_name, cache_dir=cache_dir, max_length=RERANK_MAX_LENGTH)
+    if threads > 0:
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        model_file = sorted(Path(ranker.model_dir).glob("*.onnx"))[0]
+        ranker.session = ort.InferenceSession(str(model_file), sess_options=options, providers=["CPUExecutionProvider"])
+    return ranker
+
+class RerankUnavailable(Exception):
+    """Der gemeinsame Reranker-Prozess ist nicht erreichbar."""
+
+class RerankService:
+    """Asynchroner Reranker mit Score-Cache und Micro-Batching über alle laufenden Anfragen."""
+
+    def __init__(self, model_name=RERANK_MODEL, workers=RERANK_WORKERS, threads=RERANK_THREADS,
+                 batch_window_ms=RERANK_BATCH_WINDOW_MS, max_batch=RERANK_MAX_BATCH, socket_path=RERANK_SOCKET):
+        self.model_name = model_name
+        self.enabled = model_name.lower() != "none"
+        self.socket_path = socket_path if self.enabled else ""
+        self._remote_ready = False
+        self.threads = threads
+        self.ranker = None
+        self._load_lock = threading.Lock()
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch = max_batch
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rerank")
+        self.scores = TTLCache("rerank_scores", max_entries=RERANK_CACHE_ENTRIES, ttl=RERANK_CACHE_TTL)
+        self.batches = 0
+        self.pairs = 0
+        self._slots = asyncio.Semaphore(workers)
+        self._queue = None
+        self._task = None
+        self._batch_tasks = set()
+
+    @property
+    def ready(self):
+        return not self.enabled or self.ranker is not None or self._remote_ready
+
+    def load(self):
+        with self._load_lock:
+            if self.enabled and self.ranker is None:
+                self.ranker = load_cross_encoder(self.model_name, RERANK_CACHE_DIR, self.threads)
+
+    async def warm_up(self, retry_delay=1.0):
+        """Modell laden und einen Forward-Pass ausführen bzw. warten, bis der Reranker-Prozess antwortet."""
+        if not self.enabled:
+            return
+        if not self.socket_path:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self._score, [("warm-up", "warm-up")])
+            return
+        while True:
+            try:
+                await self._score_remote("warm-up", ["warm-up"])
+                return
+            except RerankUnavailable:
+                await asyncio.sleep(retry_delay)
+
+    def start(self):
+        if self.enabled and not self.socket_path and self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._batch_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.executor.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            "model": self.model_name,
+            "loaded": self.ready,
+            "remote": self.socket_path or None,
+            "batches": self.batches,
+            "pairs": self.pairs,
+            "avg_batch": round(self.pairs / self.batches, 2) if self.batches else 0.0,
+            "cache": self.scores.stats(),
+        }
+
+    async def rerank(self, query, passages, top_k=None):
+        """
+        passages: [{"id", "text", "meta": {"fusion_score", ...}}, ...]
+        Gibt die Passagen absteigend nach "score" zurück (wie flashrank.Ranker.rerank).
+        """
+        # Jeder Chunk nur einmal, in Reihenfolge der ersten Stufe
+        unique = {}
+        for p in passages:
+            unique.setdefault(p["id"], p)
+        candidates = sorted(unique.values(), key=lambda p: p["meta"].get("fusion_score", 0.0), reverse=True)
+        if candidates and RERANK_MIN_FUSION_RATIO > 0:
+            floor = candidates[0]["meta"].get("fusion_score", 0.0) * RERANK_MIN_FUSION_RATIO
+            candidates = [p for p in candidates if p["meta"].get("fusion_score", 0.0) >= floor]
+        candidates = candidates[:RERANK_MAX_CANDIDATES]
+
+        if not self.enabled:
+            for p in candidates:
+                p["score"] = p["meta"].get("fusion_score", 0.0)
+            return candidates[:top_k]
+
+        # Chunk-IDs ändern sich beim Re-Indexing, gecachte Scores veralten also nie
+        query_key = normalize_key(query)
+        missing = []
+        for p in candidates:
+            score = self.scores.get((query_key, p["id"]))
+            if score is None:
+                missing.append(p)
+            else:
+                p["score"] = score
+
+        if missing:
+            try:
+                scores = await self.score_passages(query, missing)
+            except RerankUnavailable as e:
+                # Reranker-Prozess nicht erreichbar: Reihenfolge der Rank Fusion statt Fehler
+                logger.warning("⚠️ %s, nutze Reihenfolge der Rank Fusion", e)
+                for p in candidates:
+                    p["score"] = p["meta"].get("fusion_score", 0.0)
+                return candidates[:top_k]
+            for p, score in zip(missing, scores):
+                p["score"] = score
+                self.scores.set((query_key, p["id"]), score)
+
+        candidates.sort(key=lambda p: p["score"], reverse=True)
+        return candidates[:top_k]
+
+    async def score_passages(self, query, passages):
+        """Scores für (Frage, Passage)-Paare: lokal über das Micro-Batching oder über den Reranker-Prozess."""
+        if self.socket_path:
+            return await self._score_remote(query, [p["text"] for p in passages])
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, passages, future))
+        return await future
+
+    async def check(self, timeout=2.0):
+        """Für /ready: im Remote-Modus prüfen, ob der Reranker-Prozess (wieder) antwortet."""
+        if self.socket_path and not self._remote_ready:
+            try:
+                await asyncio.wait_for(self._score_remote("warm-up", ["warm-up"]), timeout)
+            except (RerankUnavailable, asyncio.TimeoutError):
+                pass
+        return self.ready
+
+    async def _score_remote(self, query, texts):
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.socket_path)
+            try:
+                writer.write(_frame({"query": query, "texts": texts}))
+                await writer.drain()
+                response = await _read_frame(reader)
+            finally:
+                writer.close()
+        except (OSError, asyncio.IncompleteReadError) as e:
+            self._remote_ready = False
+            raise RerankUnavailable(f"Reranker-Prozess nicht erreichbar ({e})") from e
+        self._remote_ready = True
+        if "error" in response:
+            raise RerankUnavailable(f"Reranker-Prozess meldet Fehler: {response['error']}")
+        self.batches += 1
+        self.pairs += len(texts)
+        return response["scores"]
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0][1])
+            # Kurz auf weitere Anfragen warten, die in denselben Forward-Pass passen
+            deadline = loop.time() + self.batch_window
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[1])
+            await self._slots.acquire()
+            # Referenz halten, sonst kann der Task mitten im Lauf eingesammelt werden
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch):
+        try:
+            pairs = [(query, p["text"]) for query, passages, _ in batch for p in passages]
+            scores = await asyncio.get_running_loop().run_in_executor(self.executor, self._score, pairs)
+            self.batches += 1
+            self.pairs += len(pairs)
+            RERANK_BATCH_PAIRS.observe(len(pairs))
+            offset = 0
+            for _, passages, future in batch:
+                if not future.done():
+                    future.set_result(scores[offset:offset + len(passages)])
+                offset += len(passages)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    def _score(self, pairs):
+        """Cross-Encoder-Scores für (Frage, Text)-Paare, in Blöcken von max_batch."""
+        self.load()
+        tokenizer, session = self.ranker.tokenizer, self.ranker.session
+        scores = []
+        for start in range(0, len(pairs), self.max_batch):
+            encoded = tokenizer.encode_batch(pairs[start:start + self.max_batch])
+            onnx_input = {
+                "input_ids": np.array([e.ids for e in encoded], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encoded], dtype=np.int64),
+            }
+            token_type_ids = np.array([e.type_ids for e in encoded], dtype=np.int64)
+            if any(i.name == "token_type_ids" for i in session.get_inputs()):
+                onnx_input["token_type_ids"] = token_type_ids
+            logits = session.run(None, onnx_input)[0]
+            if logits.shape[1] == 1:
+                batch_scores = 1 / (1 + np.exp(-logits.flatten()))
+            else:
+                exp_logits = np.exp(logits)
+                batch_scores = exp_logits[:, 1] / np.sum(exp_logits, axis=1)
+            scores.extend(float(s) for s in batch_scores)
+        return scores
+
+async def serve(socket_path=RERANK_SOCKET):
+    """
+    Gemeinsamer Reranker für alle API-Worker: ein Modell im Speicher, Micro-Batching
+    über die Anfragen aller Worker hinweg. Jede Verbindung schickt {"query", "texts"}
+    und erhält {"scores"} bzw. {"error"} zurück.
+    """
+    service = RerankService(socket_path="")
+    await service.warm_up()
+    service.start()
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                request = await _read_frame(reader)
+                try:
+                    passages = [{"text": text} for text in request["texts"]]
+                    response = {"scores": await service.score_passages(request["query"], passages)}
+                except Exception as e:
+                    response = {"error": str(e)}
+                writer.write(_frame(response))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(handle, path=socket_path)
+    logger.info("🧮 Reranker '%s' bereit auf %s", service.model_name, socket_path)
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if not RERANK_SOCKET:
+        raise SystemExit("RERANK_SOCKET nicht gesetzt.")
+    asyncio.run(serve())
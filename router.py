@@ -0,0 +1,82 @@
+import os
+import re
+import logging
+from cache import normalize_key
+from metrics import span, record_llm_usage
+
+# Leichtgewichtiges Routing vor Suche und Rewriting:
+# Smalltalk (Grüße, Dank, "Wer bist du?") braucht weder Retrieval noch Query-Rewriting.
+# Erst greifen Regeln, optional danach ein kleines LLM für kurze, unklare Nachrichten.
+
+logger = logging.getLogger("rag.router")
+
+# Kurze Nachrichten ohne bekannte Entität zusätzlich per LLM einordnen (kostet einen kleinen LLM-Aufruf)
+ROUTER_LLM = os.getenv("ROUTER_LLM", "false").lower() in ("1", "true", "yes")
+ROUTER_MAX_WORDS = int(os.getenv("ROUTER_MAX_WORDS", "12"))
+
+_UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+
+# Eine Nachricht ist Smalltalk, wenn sie nur aus diesen Floskeln besteht ("hallo, wie geht's dir?")
+_SMALLTALK_PHRASE = r"""(?:
+    (?:hi|hallo|hey|moin|moinsen|servus|gruess\ gott|guten\ (?:morgen|tag|abend)|hello)(?:\ (?:zusammen|alle|leute|du|bot))?
+  | (?:danke|vielen\ dank|danke\ schoen|dankeschoen|merci|thx|thanks)(?:\ (?:dir|ihnen|sehr|vielmals|fuer\ die\ (?:hilfe|antwort|info)))*
+  | tschuess|ciao|bye|bis\ (?:bald|dann|morgen|spaeter)|auf\ wiedersehen|schoenen\ tag(?:\ noch)?
+  | wie\ gehts?(?:\ (?:dir|ihnen|es\ dir|es\ ihnen))?|wie\ geht\ es\ (?:dir|ihnen)
+  | wer\ bist\ du|was\ bist\ du|wie\ heisst\ du|was\ kannst\ du(?:\ alles)?
+  | ok|okay|alles\ klar|super|prima|top|perfekt|gut|cool|verstanden
+)"""
+SMALLTALK_RE = re.compile(rf"{_SMALLTALK_PHRASE}(?:\ {_SMALLTALK_PHRASE})*", re.X)
+
+# Verweise auf frühere Nachrichten: nur dann lohnt sich das Rewriting mit dem Verlauf
+REFERENCE_WORDS = {
+    "er", "sie", "es", "ihm", "ihn", "ihr", "ihre", "ihren", "ihrem", "sein", "seine", "seinen", "seinem",
+    "dort", "dorthin", "dies", "diese", "dieser", "dieses", "diesem", "diesen", "dessen", "deren", "denen",
+    "davon", "dazu", "damit", "darueber", "daran", "darauf", "dafuer", "dabei", "darin", "dasselbe", "dieselbe",
+    "derselbe", "jener", "jene", "jenes", "ebenfalls", "auch", "noch",
+}
+
+ROUTER_PROMPT = """Ordne die Nachricht an einen Firmen-Wissensassistenten ein.
+FACH: Frage zu Firma, Projekten, Personen, Dokumenten, Vorschriften oder Fachthemen.
+SMALLTALK: Begrüßung, Dank, Small Talk oder Fragen an den Assistenten selbst.
+Nachricht: '{message}'
+Antworte NUR mit FACH oder SMALLTALK."""
+
+def normalize_message(text):
+    text = str(text).lower().translate(_UMLAUTS).replace("'", "")
+    return " ".join(re.findall(r"[a-z0-9]+", text))
+
+def is_smalltalk(text):
+    normalized = normalize_message(text)
+    return bool(normalized) and SMALLTALK_RE.fullmatch(normalized) is not None
+
+def needs_rewrite(text, has_entities):
+    """Rewriting nur bei Verweisen auf den Verlauf oder wenn die Frage kein bekanntes Subjekt nennt."""
+    words = normalize_message(text).split()
+    return not has_entities or any(w in REFERENCE_WORDS for w in words)
+
+async def classify_with_llm(llm, text, cache=None):
+    key = normalize_key(text)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    try:
+        with span("api", "route_llm"):
+            res = await llm.ainvoke([("user", ROUTER_PROMPT.format(message=text))])
+        record_llm_usage("router", res)
+        route = "smalltalk" if "SMALLTALK" in res.content.upper() else "domain"
+    except Exception as e:
+        logger.warning("Fehler beim Routing, nutze Suche: %s", e)
+        return "domain"
+    if cache is not None:
+        cache.set(key, route)
+    return route
+
+async def route_message(text, matcher, llm=None, cache=None):
+    """'smalltalk' (ohne Suche und Rewriting beantworten) oder 'domain'."""
+    if is_smalltalk(text):
+        return "smalltalk"
+    # Bekannte Entitäten oder längere Nachrichten sind immer Fachfragen
+    if not ROUTER_LLM or llm is None or matcher.match(text) or len(text.split()) > ROUTER_MAX_WORDS:
+        return "domain"
+    return await classify_with_llm(llm, text, cache)